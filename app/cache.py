@@ -0,0 +1,128 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+from bson import ObjectId
+from config import settings
+from database import groups_collection, users_collection
+from app.metrics import CACHE_REQUESTS, CACHE_SIZE
+
+class TTLCache:
+    """
+    Small in-process cache with LRU eviction and a per-entry time-to-live
+    """
+
+    # Constructor to initialize the cache; name labels its metrics
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = CACHE_REQUESTS.labels(name, "hit")
+        self.misses = CACHE_REQUESTS.labels(name, "miss")
+        CACHE_SIZE.labels(name).set_function(lambda: len(self.entries))
+
+    # Get a value, or None if it is missing or expired
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses.inc()
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            self.misses.inc()
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits.inc()
+        return value
+
+    # Store a value, evicting the least recently used entry when full
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    # Drop a single key
+    def invalidate(self, key: Hashable):
+        self.entries.pop(key, None)
+
+    # Drop every entry whose value matches the predicate
+    def invalidate_where(self, predicate: Callable[[Any], bool]):
+        for key in [key for key, (_, value) in self.entries.items() if predicate(value)]:
+            del self.entries[key]
+
+    # Drop everything
+    def clear(self):
+        self.entries.clear()
+
+# Group id -> {"name", "members", "member_set"}
+group_cache = TTLCache("group", maxsize=settings.group_cache_size, ttl=settings.group_cache_ttl_seconds)
+
+async def get_group_membership(group_id: str) -> Optional[dict]:
+    """
+    Return the cached name and members of a group, loading it from the database on a miss
+    """
+
+    group = group_cache.get(group_id)
+    if group is not None:
+        return group
+
+    document = await groups_collection.find_one({"_id": ObjectId(group_id)}, {"name": 1, "members": 1})
+    if not document:
+        return None
+
+    group = {
+        "name": document["name"],
+        "members": list(document["members"]),
+        "member_set": frozenset(document["members"])
+    }
+    group_cache.set(group_id, group)
+    return group
+
+def invalidate_group(group_id: str):
+    """
+    Forget a group's cached membership after it changes, on this node; manager.invalidate reaches every node
+    """
+
+    group_cache.invalidate(group_id)
+
+def invalidate_groups_of_member(member_id: str):
+    """
+    Forget every cached group the given user belongs to, on this node
+    """
+
+    group_cache.invalidate_where(lambda group: member_id in group["member_set"])
+
+# User id -> public summary {"_id", "username"}
+user_summary_cache = TTLCache("user_summary", maxsize=settings.user_summary_cache_size, ttl=settings.user_summary_cache_ttl_seconds)
+
+async def get_user_summaries(user_ids: Iterable[str]) -> Dict[str, dict]:
+    """
+    Return public summaries of the given users, fetching all cache misses in one query
+    """
+
+    summaries = {}
+    misses = []
+    for user_id in set(user_ids):
+        summary = user_summary_cache.get(user_id)
+        if summary is not None:
+            summaries[user_id] = summary
+        elif ObjectId.is_valid(user_id):
+            misses.append(ObjectId(user_id))
+
+    if misses:
+        async for user in users_collection.find({"_id": {"$in": misses}}, {"username": 1}):
+            summary = {"_id": str(user["_id"]), "username": user["username"]}
+            user_summary_cache.set(summary["_id"], summary)
+            summaries[summary["_id"]] = summary
+
+    return summaries
+
+def invalidate_user(user_id: str):
+    """
+    Forget a user's cached summary after it changes, on this node
+    """
+
+    user_summary_cache.invalidate(user_id)
@@ -1,8 +1,13 @@
-from fastapi import APIRouter, HTTPException
-from database import users_collection ,groups_collection
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+from database import users_collection ,groups_collection, messages_collection
 from bson import ObjectId
 from app.hq.model import GroupModel, AddMembersModel
 from app.logs.routes import create_log
+from app.messages.controller import manager
+from app.messages.watermarks import init_member_watermarks, remove_watermarks
+from app.responses import FastJSONResponse
+from app.utils import store_revocation
 import os, base64
 
 # Router for HQ endpoints
@@ -18,10 +23,7 @@ async def get_all_users():
         users_cursor = users_collection.find({}, {"password": 0})
         users = await users_cursor.to_list(length=None)
 
-        for user in users:
-            user["_id"] = str(user["_id"])
-
-        return {"users": users}
+        return FastJSONResponse({"users": users})
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -35,9 +37,7 @@ async def get_unverified_users():
     try:
         users_cursor = users_collection.find({"is_verified": False}, {"password": 0})
         users = await users_cursor.to_list(length=None)
-        for user in users:
-            user["_id"] = str(user["_id"])
-        return {"unverified_users": users}
+        return FastJSONResponse({"unverified_users": users})
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -50,6 +50,7 @@ async def set_user_verified(id: str):
 
     try:
         result = await users_collection.update_one({"_id":ObjectId(id) }, {"$set": {"is_verified": True}})
+        await manager.invalidate("user", id)
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
         user = await users_collection.find_one({"_id": ObjectId(id)})
@@ -60,37 +61,53 @@ async def set_user_verified(id: str):
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 @hq_router.get("/all-groups")
-async def get_all_groups():
+async def get_all_groups(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    counts_only: bool = False
+):
     """
-    Retrieve all groups along with their member details.
+    Retrieve groups along with their member details, one page at a time.
+    Pass the returned next_cursor to get the following page.
+    counts_only=true returns member counts instead of member details.
     """
 
-    groups_data = []
+    if cursor is not None and not ObjectId.is_valid(cursor):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
     try:
-        groups_cursor = groups_collection.find({})
-        groups = await groups_cursor.to_list(length=None)
-
-        for group in groups:
-            group["_id"] = str(group["_id"])
-            members_id_list = group["members"]
-
-            users_cursor = users_collection.find(
-                {"_id": {"$in": [ObjectId(member_id) for member_id in members_id_list]}},
-                {"password": 0}
-            )
-            member_details = await users_cursor.to_list(length=None)
-
-            for member in member_details:
-                member["_id"] = str(member["_id"])
-                
-            group_info = {
+        query = {"_id": {"$gt": ObjectId(cursor)}} if cursor else {}
+        groups_cursor = groups_collection.find(query, {"name": 1, "members": 1}).sort("_id", 1).limit(limit)
+        groups = await groups_cursor.to_list(length=limit)
+        next_cursor = str(groups[-1]["_id"]) if len(groups) == limit else None
+
+        if counts_only:
+            return FastJSONResponse({
+                "groups": [
+                    {"_id": group["_id"], "name": group["name"], "member_count": len(group["members"])}
+                    for group in groups
+                ],
+                "next_cursor": next_cursor
+            })
+
+        # Fetch the members of every group on the page in one query
+        member_ids = {member_id for group in groups for member_id in group["members"] if ObjectId.is_valid(member_id)}
+        users_cursor = users_collection.find(
+            {"_id": {"$in": [ObjectId(member_id) for member_id in member_ids]}},
+            {"password": 0}
+        )
+        users_by_id = {str(user["_id"]): user async for user in users_cursor}
+
+        groups_data = [
+            {
                 "_id": group["_id"],
                 "name": group["name"],
-                "members": member_details
+                "members": [users_by_id[member_id] for member_id in group["members"] if member_id in users_by_id]
             }
-            groups_data.append(group_info)
-        
-        return {"groups": groups_data}
+            for group in groups
+        ]
+
+        return FastJSONResponse({"groups": groups_data, "next_cursor": next_cursor})
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -107,9 +124,12 @@ async def create_group(group: GroupModel):
 
         group_data = group.model_dump()
         group_data["symmetric_key"] = base64.b64encode(symmetric_key_bytes).decode()
+        group_data["last_seq"] = 0
+
+        result = await groups_collection.insert_one(group_data)
+        await manager.invalidate("group", str(result.inserted_id))
+        await init_member_watermarks(str(result.inserted_id), group.members)
 
-        await groups_collection.insert_one(group_data)
-        
         await create_log(username="admin", action="CREATE_GROUP", target=group.name)
 
         return {"message": "Group created successfully"}
@@ -158,6 +178,8 @@ async def add_members_to_group(group_id: str, add_members_data: AddMembersModel)
             {"_id": ObjectId(group_id)},
             {"$addToSet": {"members": {"$each": add_members_data.members}}}
         )
+        await manager.invalidate("group", group_id)
+        await init_member_watermarks(group_id, add_members_data.members)
         group = await groups_collection.find_one({"_id": ObjectId(group_id)})
         user = await users_collection.find_one({"_id": ObjectId(add_members_data.members[0])})
         await create_log(username="admin", action="ADD_MEMBERS_TO_GROUP", target=f"{user["username"] } to {group["name"]}")
@@ -184,8 +206,10 @@ async def delete_member_from_group(group_id: str, member_id: str):
             {"_id": ObjectId(group_id)},
             {"$pull": {"members": member_id}}
         )
+        await manager.invalidate("group", group_id)
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Group not found")
+        await remove_watermarks(user_id=member_id, group_id=group_id)
 
         user = await users_collection.find_one({"_id": ObjectId(member_id)})
         group = await groups_collection.find_one({"_id": ObjectId(group_id)})
@@ -204,9 +228,14 @@ async def delete_group(group_id: str):
     try:
         group = await groups_collection.find_one({"_id": ObjectId(group_id)})
         result = await groups_collection.delete_one({"_id":ObjectId(group_id) })
+        await manager.invalidate("group", group_id)
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Group not found")
 
+        # Drop the group's undelivered messages and delivery state
+        await messages_collection.delete_many({"group_id": group_id})
+        await remove_watermarks(group_id=group_id)
+
         
         await create_log(username="admin", action="DELETE_GROUP", target=group["name"])
         return {"message": f"Group {group_id} has been deleted"}
@@ -223,6 +252,10 @@ async def delete_user(user_id: str):
     try:
         user = await users_collection.find_one({"_id": ObjectId(user_id)})
         result = await users_collection.delete_one({"_id": ObjectId(user_id)})
+        await manager.invalidate("user", user_id)
+        if result.deleted_count:
+            await store_revocation(user_id)
+        await manager.invalidate("user_tokens", user_id)
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
 
@@ -231,6 +264,8 @@ async def delete_user(user_id: str):
             {"members": user_id},
             {"$pull": {"members": user_id}}
         )
+        await manager.invalidate("groups_of_member", user_id)
+        await remove_watermarks(user_id=user_id)
 
         await create_log(username="admin", action="DELETE_USER", target=user["username"])
         return {"message": f"User {user_id} has been deleted"}
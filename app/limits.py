@@ -0,0 +1,204 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable
+from fastapi import HTTPException, Request
+from starlette.responses import JSONResponse
+from config import settings
+from app.metrics import ADMISSION_IN_FLIGHT, RATE_LIMITED, RATE_LIMIT_KEYS, SHED_LOAD
+
+class TokenBucket:
+    """
+    Tokens refilled continuously at a fixed rate up to a burst size
+    """
+
+    __slots__ = ("tokens", "updated")
+
+    # Constructor to initialize a full bucket
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+class RateLimiter:
+    """
+    In-process token buckets keyed by user id or client IP. Buckets are kept in LRU order and the
+    least recently used are forgotten past max_keys; a forgotten bucket comes back full.
+    """
+
+    # Constructor to initialize the limiter; a rate of 0 disables it
+    def __init__(self, name: str, rate: float, burst: float, max_keys: int = None):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys or settings.rate_limit_max_keys
+        self.buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        RATE_LIMIT_KEYS.labels(name).set_function(lambda: len(self.buckets))
+
+    # Take cost tokens; returns 0 when allowed, otherwise the seconds until the cost would fit
+    def acquire(self, key: Hashable, cost: float = 1) -> float:
+        if self.rate <= 0:
+            return 0.0
+
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.burst, now)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+            self.buckets.move_to_end(key)
+
+        if bucket.tokens >= cost:
+            bucket.tokens -= cost
+            return 0.0
+
+        RATE_LIMITED.labels(self.name).inc()
+        return (cost - bucket.tokens) / self.rate
+
+    # Whether a cost can ever be taken: a full bucket holds at most burst tokens
+    def fits(self, cost: float) -> bool:
+        return self.rate <= 0 or cost <= self.burst
+
+class ConcurrencyLimit:
+    """
+    Global cap on work in flight; callers that find it full are shed instead of queued. A limit of 0 disables it.
+    """
+
+    # Constructor to initialize the cap
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        ADMISSION_IN_FLIGHT.labels(name).set_function(lambda: self.in_flight)
+
+    # Take a slot, or return False (and count the shed request) if none is free
+    def try_acquire(self) -> bool:
+        if self.limit > 0 and self.in_flight >= self.limit:
+            SHED_LOAD.labels(self.name).inc()
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+def retry_after_header(seconds: float) -> dict:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+def client_ip(request: Request) -> str:
+    """
+    Address of the connecting client; behind a proxy, run uvicorn with --proxy-headers so this is the real client
+    """
+
+    return request.client.host if request.client else "unknown"
+
+# Limiters shared by the whole process
+login_limiter = RateLimiter("login", settings.login_rate_per_ip, settings.login_burst_per_ip)
+signup_limiter = RateLimiter("signup", settings.signup_rate_per_ip, settings.signup_burst_per_ip)
+api_limiter = RateLimiter("api", settings.api_rate_per_user, settings.api_burst_per_user)
+ws_message_limiter = RateLimiter("ws_message", settings.ws_message_rate_per_user, settings.ws_message_burst_per_user)
+
+http_admission = ConcurrencyLimit("http", settings.http_max_concurrency)
+auth_admission = ConcurrencyLimit("auth", settings.auth_max_concurrency)
+ws_send_admission = ConcurrencyLimit("ws_send", settings.ws_max_concurrent_sends)
+
+def limit_by_ip(limiter: RateLimiter) -> Callable:
+    """
+    Dependency answering 429 with Retry-After once a client IP exceeds the limiter: Depends(limit_by_ip(login_limiter))
+    """
+
+    async def dependency(request: Request):
+        retry_after = limiter.acquire(client_ip(request))
+        if retry_after:
+            raise HTTPException(status_code=429, detail="Too many requests", headers=retry_after_header(retry_after))
+
+    return dependency
+
+def limit_user(user_id: str, limiter: RateLimiter = api_limiter):
+    """
+    Charge one request to a user's bucket, raising 429 with Retry-After when it is empty
+    """
+
+    retry_after = limiter.acquire(user_id)
+    if retry_after:
+        raise HTTPException(status_code=429, detail="Too many requests", headers=retry_after_header(retry_after))
+
+async def admit_auth():
+    """
+    Dependency shedding password checks with 503 once auth_max_concurrency are already waiting on bcrypt
+    """
+
+    if not auth_admission.try_acquire():
+        raise HTTPException(
+            status_code=503, detail="Server busy, try again later",
+            headers=retry_after_header(settings.overload_retry_after_seconds)
+        )
+    try:
+        yield
+    finally:
+        auth_admission.release()
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware answering 503 once http_max_concurrency requests are in flight, before any work is done for them
+    """
+
+    # Constructor to initialize the middleware
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if not http_admission.try_acquire():
+            response = JSONResponse(
+                {"detail": "Server busy, try again later"}, status_code=503,
+                headers=retry_after_header(settings.overload_retry_after_seconds)
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            http_admission.release()
+
+class BodyLimitMiddleware:
+    """
+    ASGI middleware answering 413 for request bodies over upload_max_bytes plus request_body_overhead_bytes,
+    checked against Content-Length up front and counted as the body arrives, before the app spools any of it
+    """
+
+    # Constructor to initialize the middleware
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = settings.upload_max_bytes + settings.request_body_overhead_bytes
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": "Request body too large"}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        # Chunked bodies carry no Content-Length, so the bytes are counted as the app reads them
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
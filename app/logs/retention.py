@@ -0,0 +1,131 @@
+import zlib
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from bson import Binary
+from config import settings
+from database import logs_collection, log_archive_collection, log_rollups_collection, ensure_ttl_index
+from app.logs.routes import as_utc, bucket_start
+from app.responses import dumps
+from app.metrics import AUDIT_LOG_ARCHIVE_DOCUMENTS, AUDIT_LOG_ARCHIVED, AUDIT_LOG_ARCHIVED_UNTIL, AUDIT_LOG_COMPACTIONS
+
+# Archive document holding how far the raw logs have been archived
+STATE_ID = "state"
+
+# Order of the values in each archived entry
+ARCHIVE_FIELDS = ["_id", "timestamp", "username", "action", "target"]
+
+def days(count: int) -> int:
+    return count * 24 * 3600
+
+class LogCompactor:
+    """
+    Rolls raw audit log entries into compressed archive documents, an hour of logs at a time,
+    log_archive_lead_hours before the TTL index on logs drops them
+    """
+
+    # Everything older than this is archived on each run
+    def cutoff(self, now: datetime) -> datetime:
+        return bucket_start(now - timedelta(days=settings.log_retention_days, hours=-settings.log_archive_lead_hours), "hour")
+
+    # Start of the first hour not yet archived, or None if there is nothing to archive
+    async def archived_until(self) -> Optional[datetime]:
+        state = await log_archive_collection.find_one({"_id": STATE_ID})
+        if state:
+            return as_utc(state["archived_until"])
+
+        oldest = await logs_collection.find_one({}, {"timestamp": 1}, sort=[("timestamp", 1), ("_id", 1)])
+        return bucket_start(as_utc(oldest["timestamp"]), "hour") if oldest else None
+
+    # Whether every entry the logs TTL would remove has been archived
+    async def caught_up(self) -> bool:
+        start = await self.archived_until()
+        return start is None or start >= self.cutoff(datetime.now(timezone.utc))
+
+    # Archive every full hour before the cutoff, returning the number of entries archived
+    async def compact(self) -> int:
+        if settings.log_retention_days <= 0:
+            return 0
+
+        now = datetime.now(timezone.utc)
+        cutoff = self.cutoff(now)
+        start = await self.archived_until()
+        expired_before = now - timedelta(days=settings.log_retention_days)
+        if start is not None and start < expired_before and "timestamp_ttl" in await logs_collection.index_information():
+            print(f"Audit logs from before {expired_before} may have expired unarchived (archived until {start})")
+
+        archived = 0
+        while start is not None and start < cutoff:
+            end = start + timedelta(hours=1)
+            archived += await self.archive_hour(start, end)
+            await log_archive_collection.update_one({"_id": STATE_ID}, {"$set": {"archived_until": end}}, upsert=True)
+
+            # Skip empty hours straight to the next entry
+            following = await logs_collection.find_one(
+                {"timestamp": {"$gte": end}}, {"timestamp": 1}, sort=[("timestamp", 1), ("_id", 1)]
+            )
+            start = max(end, bucket_start(as_utc(following["timestamp"]), "hour")) if following else None
+
+        until = await self.archived_until()
+        if until is not None:
+            AUDIT_LOG_ARCHIVED_UNTIL.set(until.timestamp())
+        AUDIT_LOG_COMPACTIONS.inc()
+        return archived
+
+    # Archive one hour of entries in parts of log_archive_part_size; reruns overwrite the same parts
+    async def archive_hour(self, start: datetime, end: datetime) -> int:
+        cursor = logs_collection.find(
+            {"timestamp": {"$gte": start, "$lt": end}}, {field: 1 for field in ARCHIVE_FIELDS}
+        ).sort([("timestamp", 1), ("_id", 1)]).batch_size(settings.log_archive_part_size)
+
+        part, rows, count = 0, [], 0
+        async for log in cursor:
+            rows.append([log.get(field) for field in ARCHIVE_FIELDS])
+            if len(rows) >= settings.log_archive_part_size:
+                await self.write_part(start, part, rows)
+                part, count, rows = part + 1, count + len(rows), []
+        if rows:
+            await self.write_part(start, part, rows)
+            count += len(rows)
+        return count
+
+    async def write_part(self, hour: datetime, part: int, rows: list):
+        await log_archive_collection.replace_one({"_id": f"{hour:%Y-%m-%dT%H}:{part}"}, {
+            "hour": hour,
+            "part": part,
+            "count": len(rows),
+            "fields": ARCHIVE_FIELDS,
+            "entries": Binary(zlib.compress(dumps(rows)))
+        }, upsert=True)
+        AUDIT_LOG_ARCHIVED.inc(len(rows))
+        AUDIT_LOG_ARCHIVE_DOCUMENTS.inc()
+
+    # Compact, then apply the retention settings, every log_compaction_interval_seconds
+    async def run_loop(self):
+        while True:
+            try:
+                await self.compact()
+                await apply_retention(archive_caught_up=True)
+            except Exception as e:
+                print("Audit log compaction failed:", e)
+            await asyncio.sleep(settings.log_compaction_interval_seconds)
+
+# Shared compactor, started and stopped by the app lifespan
+log_compactor = LogCompactor()
+
+async def apply_retention(archive_caught_up: bool = None):
+    """
+    Point the TTL indexes at the retention settings. Raw logs only get (or shorten) their TTL once the
+    archive holds everything it would remove.
+    """
+
+    await ensure_ttl_index(log_archive_collection, "hour_ttl", "hour", days(settings.log_archive_retention_days))
+    await ensure_ttl_index(
+        log_rollups_collection, "minute_bucket_ttl", "bucket", days(settings.log_rollup_minute_retention_days),
+        partial={"granularity": "minute"}
+    )
+
+    if archive_caught_up is None:
+        archive_caught_up = await log_compactor.caught_up()
+    if archive_caught_up or settings.log_retention_days <= 0:
+        await ensure_ttl_index(logs_collection, "timestamp_ttl", "timestamp", days(settings.log_retention_days))
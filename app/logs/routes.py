@@ -1,35 +1,302 @@
-from database import logs_collection
-from fastapi import APIRouter, HTTPException
+import math
+import asyncio
+import base64
+from collections import Counter
+from database import logs_collection, log_rollups_collection
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from bson import ObjectId
-from datetime import datetime, timezone
+from pymongo import UpdateOne
+from datetime import datetime, timedelta, timezone
+from typing import Literal, Optional
+from config import settings
+from app.responses import FastJSONResponse, dumps
+from app.metrics import AUDIT_LOG_ENTRIES, AUDIT_LOG_QUEUED
 log_router = APIRouter()
 
+class LogWriter:
+    """
+    Buffers audit log entries in a bounded queue and writes them with insert_many,
+    flushing when a batch fills up or the flush interval elapses
+    """
+
+    # Constructor to initialize the writer
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        AUDIT_LOG_QUEUED.set_function(lambda: self.queue.qsize() if self.queue else 0)
+
+    # Start the background writer task
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=settings.log_queue_size)
+        self.task = asyncio.create_task(self.run())
+
+    # Flush everything still queued and stop the writer task
+    async def stop(self):
+        if self.task is None:
+            return
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+
+    # Queue an entry without waiting, applying the overflow policy when full
+    def enqueue(self, entry: dict) -> bool:
+        try:
+            self.queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            AUDIT_LOG_ENTRIES.labels("dropped").inc()
+            if settings.log_overflow_policy == "drop_newest":
+                return False
+            self.queue.get_nowait()
+            self.queue.put_nowait(entry)
+        AUDIT_LOG_ENTRIES.labels("enqueued").inc()
+        return True
+
+    # Collect batches and write them until stopped
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            entry = await self.queue.get()
+            if entry is None:
+                break
+
+            batch = [entry]
+            deadline = loop.time() + settings.log_flush_interval_seconds
+            while len(batch) < settings.log_batch_size:
+                try:
+                    entry = await asyncio.wait_for(self.queue.get(), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+
+            await self.write(batch)
+
+    # Write one batch, then add it to the rollups
+    async def write(self, batch: list):
+        try:
+            await logs_collection.insert_many(batch, ordered=False)
+            AUDIT_LOG_ENTRIES.labels("flushed").inc(len(batch))
+        except Exception as e:
+            AUDIT_LOG_ENTRIES.labels("failed").inc(len(batch))
+            print("Audit log write failed:", e)
+            return
+
+        try:
+            await update_rollups(batch)
+        except Exception as e:
+            AUDIT_LOG_ENTRIES.labels("rollup_failed").inc(len(batch))
+            print("Audit log rollup failed:", e)
+
+# Shared audit log writer, started and stopped by the app lifespan
+log_writer = LogWriter()
+
+# Length of each rollup bucket
+GRANULARITIES = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    """
+    Start of the rollup bucket a timestamp falls in
+    """
+
+    if granularity == "minute":
+        return timestamp.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def as_utc(timestamp: datetime) -> datetime:
+    """
+    Timezone-aware UTC datetime; naive values (as MongoDB returns them) are taken to be UTC
+    """
+
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
 
+def rollup_counts(entries: list) -> Counter:
+    """
+    Count log entries by (granularity, bucket, action, username); username None holds the count over all users
+    """
 
+    counts = Counter()
+    for entry in entries:
+        for granularity in settings.log_rollup_granularities:
+            bucket = bucket_start(entry["timestamp"], granularity)
+            counts[(granularity, bucket, entry["action"], None)] += 1
+            if granularity in settings.log_rollup_user_granularities:
+                counts[(granularity, bucket, entry["action"], entry["username"])] += 1
+    return counts
+
+async def update_rollups(entries: list):
+    """
+    Add log entries to the rollups, with one $inc upsert per rollup document they touch
+    """
+
+    counts = rollup_counts(entries)
+    if counts:
+        await log_rollups_collection.bulk_write([
+            UpdateOne(
+                {"granularity": granularity, "action": action, "username": username, "bucket": bucket},
+                {"$inc": {"count": count}}, upsert=True
+            )
+            for (granularity, bucket, action, username), count in counts.items()
+        ], ordered=False)
+
+
+def encode_cursor(log: dict) -> str:
+    """
+    Opaque keyset cursor pointing just past the given log entry
+    """
+
+    raw = f"{log['timestamp'].isoformat()}|{log['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> dict:
+    """
+    Turn a cursor back into a query for the entries that come after it (newest first)
+    """
+
+    try:
+        timestamp, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        timestamp, log_id = datetime.fromisoformat(timestamp), ObjectId(log_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return {"$or": [
+        {"timestamp": {"$lt": timestamp}},
+        {"timestamp": timestamp, "_id": {"$lt": log_id}}
+    ]}
 
 @log_router.get("/all-logs")
-async def get_all_logs():
+async def get_all_logs(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    username: Optional[str] = None,
+    action: Optional[str] = None,
+    target: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    format: Literal["json", "ndjson"] = "json"
+):
     """
-    Retrieve all logs from the database
+    Retrieve logs newest first, one page at a time, optionally filtered.
+    Pass the returned next_cursor to get the following page.
+    format=ndjson streams every matching entry, one JSON object per line.
     """
 
+    # Each filter combination is served by a (field, timestamp, _id) index
+    query = {}
+    for field, value in (("username", username), ("action", action), ("target", target)):
+        if value is not None:
+            query[field] = value
+    if since or until:
+        query["timestamp"] = {}
+        if since:
+            query["timestamp"]["$gte"] = since
+        if until:
+            query["timestamp"]["$lt"] = until
+    if cursor:
+        query = {"$and": [query, decode_cursor(cursor)]}
+
+    sort = [("timestamp", -1), ("_id", -1)]
+
+    if format == "ndjson":
+        async def stream():
+            logs_cursor = logs_collection.find(query).sort(sort).batch_size(1000)
+            async for log in logs_cursor:
+                yield dumps(log) + b"\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
     try:
-        logs_cursor = logs_collection.find({})
-        logs = await logs_cursor.to_list(length=None)
+        logs_cursor = logs_collection.find(query).sort(sort).limit(limit)
+        logs = await logs_cursor.to_list(length=limit)
 
-        for log in logs:
-            log["_id"] = str(log["_id"])
+        next_cursor = encode_cursor(logs[-1]) if len(logs) == limit else None
 
-        return {"logs": logs}
+        return FastJSONResponse({"logs": logs, "next_cursor": next_cursor})
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    
+
+@log_router.get("/stats")
+async def get_log_stats(
+    granularity: Literal["minute", "hour", "day"] = "hour",
+    group_by: Literal["time", "action", "username"] = "time",
+    action: Optional[str] = None,
+    username: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(10, ge=1, le=1000)
+):
+    """
+    Log counts read from the rollups, so the cost does not depend on how many raw logs exist.
+    group_by=time: the count of every bucket from since (default: 7 days ago) to until (default: now), empty ones included.
+    group_by=action or username: totals over the range, largest first.
+    since is rounded down to the start of its bucket.
+    e.g. logins per hour this week: ?action=LOGIN
+         top users by action: ?group_by=username&action=DELETE_USER&granularity=day
+    """
+
+    if granularity not in settings.log_rollup_granularities:
+        raise HTTPException(status_code=400, detail=f"Logs are not rolled up per {granularity}")
+    per_user = username is not None or group_by == "username"
+    if per_user and granularity not in settings.log_rollup_user_granularities:
+        raise HTTPException(status_code=400, detail=f"Per-user counts are not rolled up per {granularity}")
+
+    until = as_utc(until) if until else datetime.now(timezone.utc)
+    since = bucket_start(as_utc(since) if since else until - timedelta(days=7), granularity)
+    step = GRANULARITIES[granularity]
+    buckets = math.ceil((until - since) / step)
+    if buckets <= 0:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    if buckets > settings.log_stats_max_buckets:
+        raise HTTPException(status_code=400, detail=f"Range too long for granularity {granularity}")
+
+    # Served by the (granularity, action, username, bucket) index
+    query = {"granularity": granularity, "bucket": {"$gte": since, "$lt": until}}
+    if action is not None:
+        query["action"] = action
+    if username is not None:
+        query["username"] = username
+    else:
+        query["username"] = {"$ne": None} if group_by == "username" else None
+
+    key = {"time": "$bucket", "action": "$action", "username": "$username"}[group_by]
+    pipeline = [{"$match": query}, {"$group": {"_id": key, "count": {"$sum": "$count"}}}]
+    if group_by == "time":
+        pipeline.append({"$sort": {"_id": 1}})
+    else:
+        pipeline += [{"$sort": {"count": -1, "_id": 1}}, {"$limit": limit}]
+
+    try:
+        rows = await (await log_rollups_collection.aggregate(pipeline)).to_list(length=None)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    if group_by == "time":
+        counts = {as_utc(row["_id"]): row["count"] for row in rows}
+        results = [{"bucket": since + index * step, "count": counts.get(since + index * step, 0)} for index in range(buckets)]
+    else:
+        results = [{group_by: row["_id"], "count": row["count"]} for row in rows]
+
+    return FastJSONResponse({
+        "granularity": granularity,
+        "group_by": group_by,
+        "since": since,
+        "until": until,
+        "results": results
+    })
+
  
 
 async def create_log(username: str, action: str, target: str = None):
     """
-    Insert a security log entry into MongoDB.
+    Queue a security log entry for MongoDB.
     
     Args:
         username (str): Who performed the action
@@ -42,5 +309,11 @@ async def create_log(username: str, action: str, target: str = None):
         "target": target,
         "timestamp": datetime.now(timezone.utc)
     }
-    await logs_collection.insert_one(log_entry)
-    
\ No newline at end of file
+
+    # Outside the app lifespan (e.g. scripts) write directly
+    if log_writer.task is None:
+        await logs_collection.insert_one(log_entry)
+        await update_rollups([log_entry])
+        return
+
+    log_writer.enqueue(log_entry)
@@ -0,0 +1,238 @@
+import os
+import socket
+import asyncio
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from uuid import uuid4
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+from bson import ObjectId
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+from config import settings
+from database import db, presence_collection
+
+# Called with an envelope {"recipients": [...], "frames": [{...}, ...]} or {"invalidate": kind, "key": key}
+EnvelopeHandler = Callable[[dict], Awaitable[None]]
+
+# Node id that addresses an envelope to every node but its origin
+BROADCAST = "*"
+
+def default_node_id() -> str:
+    """
+    Identify this process: configured node id, or host, pid and a random suffix
+    """
+
+    return settings.node_id or f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:6]}"
+
+class Broker(ABC):
+    """
+    Routes group messages between processes and tracks which node holds each user's socket
+    """
+
+    # Constructor to initialize the broker
+    def __init__(self, node_id: Optional[str] = None):
+        self.node_id = node_id or default_node_id()
+        self.handler: Optional[EnvelopeHandler] = None
+
+    # Start receiving envelopes addressed to this node
+    async def start(self, handler: EnvelopeHandler):
+        self.handler = handler
+
+    # Stop receiving envelopes
+    async def stop(self):
+        self.handler = None
+
+    # Send an envelope to another node
+    @abstractmethod
+    async def publish(self, node_id: str, envelope: dict):
+        ...
+
+    # Send an envelope to every other node
+    @abstractmethod
+    async def broadcast(self, envelope: dict):
+        ...
+
+    # Record that a user has a socket on this node
+    @abstractmethod
+    async def register(self, user_id: str):
+        ...
+
+    # Record that a user no longer has a socket on this node
+    @abstractmethod
+    async def unregister(self, user_id: str):
+        ...
+
+    # Map other nodes to the given users they hold
+    @abstractmethod
+    async def locate(self, user_ids: Iterable[str]) -> Dict[str, List[str]]:
+        ...
+
+class InMemoryBroker(Broker):
+    """
+    Broker for a single process; several instances sharing a hub behave like separate nodes
+    """
+
+    class Hub:
+        """
+        Shared state of the in-memory brokers: handlers and presence by node
+        """
+
+        def __init__(self):
+            self.brokers: Dict[str, "InMemoryBroker"] = {}
+            self.presence: Dict[str, Set[str]] = {}
+
+    # Constructor to initialize the broker
+    def __init__(self, node_id: Optional[str] = None, hub: Optional["InMemoryBroker.Hub"] = None):
+        super().__init__(node_id)
+        self.hub = hub or InMemoryBroker.Hub()
+        # Deliveries in flight, kept referenced until they finish
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def start(self, handler: EnvelopeHandler):
+        await super().start(handler)
+        self.hub.brokers[self.node_id] = self
+
+    async def stop(self):
+        self.hub.brokers.pop(self.node_id, None)
+        await super().stop()
+
+    async def publish(self, node_id: str, envelope: dict):
+        broker = self.hub.brokers.get(node_id)
+        if broker and broker.handler:
+            task = asyncio.create_task(broker.handler(envelope))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def broadcast(self, envelope: dict):
+        for node_id in list(self.hub.brokers):
+            if node_id != self.node_id:
+                await self.publish(node_id, envelope)
+
+    async def register(self, user_id: str):
+        self.hub.presence.setdefault(user_id, set()).add(self.node_id)
+
+    async def unregister(self, user_id: str):
+        nodes = self.hub.presence.get(user_id)
+        if nodes is not None:
+            nodes.discard(self.node_id)
+            if not nodes:
+                del self.hub.presence[user_id]
+
+    async def locate(self, user_ids: Iterable[str]) -> Dict[str, List[str]]:
+        located: Dict[str, List[str]] = {}
+        for user_id in user_ids:
+            for node_id in self.hub.presence.get(user_id, ()):
+                if node_id != self.node_id:
+                    located.setdefault(node_id, []).append(user_id)
+        return located
+
+class MongoBroker(Broker):
+    """
+    Broker backed by the shared MongoDB: a capped collection tailed by every node,
+    and a presence collection whose entries expire unless their node refreshes them
+    """
+
+    # Constructor to initialize the broker
+    def __init__(self, node_id: Optional[str] = None):
+        super().__init__(node_id)
+        self.events = db[settings.broker_events_collection]
+        self.tasks: List[asyncio.Task] = []
+
+    async def start(self, handler: EnvelopeHandler):
+        await super().start(handler)
+
+        try:
+            await db.create_collection(
+                settings.broker_events_collection, capped=True, size=settings.broker_events_size_bytes
+            )
+        except CollectionInvalid:
+            pass
+
+        await presence_collection.create_index("user_id")
+        await presence_collection.create_index("updated_at", expireAfterSeconds=settings.presence_ttl_seconds)
+
+        self.tasks = [asyncio.create_task(self.tail()), asyncio.create_task(self.refresh_presence())]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+        await presence_collection.delete_many({"node_id": self.node_id})
+        await super().stop()
+
+    async def publish(self, node_id: str, envelope: dict):
+        await self.events.insert_one({"node_id": node_id, "envelope": envelope})
+
+    async def broadcast(self, envelope: dict):
+        await self.events.insert_one({"node_id": BROADCAST, "origin": self.node_id, "envelope": envelope})
+
+    # Follow the capped collection and hand envelopes for this node, and broadcasts from other nodes, to the handler
+    async def tail(self):
+        # Only envelopes published from now on
+        last_id = ObjectId.from_datetime(datetime.now(timezone.utc))
+
+        # A tailable cursor on an empty capped collection dies immediately
+        await self.events.insert_one({"node_id": None})
+
+        while True:
+            cursor = self.events.find(
+                {"node_id": {"$in": [self.node_id, BROADCAST]}, "origin": {"$ne": self.node_id}, "_id": {"$gt": last_id}},
+                cursor_type=CursorType.TAILABLE_AWAIT
+            )
+            try:
+                async for event in cursor:
+                    last_id = event["_id"]
+                    if self.handler:
+                        await self.handler(event["envelope"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Broker tail failed:", e)
+            finally:
+                await cursor.close()
+
+            await asyncio.sleep(0.5)
+
+    # Keep this node's presence entries from expiring
+    async def refresh_presence(self):
+        while True:
+            await asyncio.sleep(settings.presence_ttl_seconds / 3)
+            try:
+                await presence_collection.update_many(
+                    {"node_id": self.node_id}, {"$set": {"updated_at": datetime.now(timezone.utc)}}
+                )
+            except Exception as e:
+                print("Presence refresh failed:", e)
+
+    async def register(self, user_id: str):
+        await presence_collection.update_one(
+            {"_id": f"{user_id}:{self.node_id}"},
+            {"$set": {"user_id": user_id, "node_id": self.node_id, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    async def unregister(self, user_id: str):
+        await presence_collection.delete_one({"_id": f"{user_id}:{self.node_id}"})
+
+    async def locate(self, user_ids: Iterable[str]) -> Dict[str, List[str]]:
+        user_ids = list(user_ids)
+        located: Dict[str, List[str]] = {}
+        if not user_ids:
+            return located
+
+        cursor = presence_collection.find(
+            {"user_id": {"$in": user_ids}, "node_id": {"$ne": self.node_id}}, {"user_id": 1, "node_id": 1}
+        )
+        async for entry in cursor:
+            located.setdefault(entry["node_id"], []).append(entry["user_id"])
+        return located
+
+def create_broker() -> Broker:
+    """
+    Build the broker selected by settings.broker_backend
+    """
+
+    if settings.broker_backend == "mongo":
+        return MongoBroker()
+    return InMemoryBroker()
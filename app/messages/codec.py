@@ -0,0 +1,102 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Optional, Union
+from config import settings
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+class WireFormat(ABC):
+    """
+    How frames are encoded on a WebSocket, selected through the Sec-WebSocket-Protocol header
+    """
+
+    name = ""
+    binary = False
+
+    @abstractmethod
+    def encode(self, data: dict) -> Union[str, bytes]:
+        ...
+
+    @abstractmethod
+    def decode(self, raw: bytes):
+        ...
+
+class JSONFormat(WireFormat):
+    """
+    Text frames, byte for byte what send_json would produce
+    """
+
+    name = "json"
+
+    def encode(self, data: dict) -> str:
+        return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+    def decode(self, raw: bytes):
+        return json.loads(raw)
+
+class MessagePackFormat(WireFormat):
+    """
+    Binary frames encoded with MessagePack
+    """
+
+    name = "msgpack"
+    binary = True
+
+    def encode(self, data: dict) -> bytes:
+        return msgpack.packb(data)
+
+    def decode(self, raw: bytes):
+        try:
+            return msgpack.unpackb(raw)
+        except Exception as e:
+            raise ValueError(str(e))
+
+JSON = JSONFormat()
+
+# Formats this process can speak, by subprotocol name
+FORMATS: Dict[str, WireFormat] = {JSON.name: JSON}
+if msgpack is not None:
+    FORMATS["msgpack"] = MessagePackFormat()
+
+def negotiate(offered: Iterable[str]) -> Optional[WireFormat]:
+    """
+    Pick the first subprotocol offered by the client that is enabled and available, or None
+    """
+
+    for name in offered:
+        if name in settings.ws_wire_formats and name in FORMATS:
+            return FORMATS[name]
+    return None
+
+def decode_message(wire: WireFormat, message: dict):
+    """
+    Decode a received WebSocket message: text is always JSON, bytes use the negotiated format
+    """
+
+    if message.get("text") is not None:
+        return JSON.decode(message["text"])
+    return wire.decode(message.get("bytes") or b"")
+
+class Frame:
+    """
+    An outbound frame shared by every recipient; each wire format encodes it at most once.
+    origin is the connection a message was sent from, which does not get it echoed back.
+    """
+
+    __slots__ = ("data", "encoded", "origin")
+
+    # Constructor to initialize the frame
+    def __init__(self, data: dict, origin=None):
+        self.data = data
+        self.encoded: Dict[str, Union[str, bytes]] = {}
+        self.origin = origin
+
+    # Encoded payload for a wire format
+    def encode(self, wire: WireFormat) -> Union[str, bytes]:
+        payload = self.encoded.get(wire.name)
+        if payload is None:
+            payload = self.encoded[wire.name] = wire.encode(self.data)
+        return payload
@@ -1,26 +1,200 @@
-import os
+import time
+import asyncio
+from collections import deque
 from datetime import datetime, timezone
 from uuid import uuid4
-from bson import ObjectId
-from fastapi import APIRouter, HTTPException, File, UploadFile
-from fastapi.concurrency import run_in_threadpool
+from fastapi import APIRouter, Depends, HTTPException, File, Request, Response, UploadFile
 from starlette.websockets import WebSocket, WebSocketDisconnect
-from app.users.controller import get_current_user_from_token
+from app.users.controller import get_current_user_from_token, get_limited_user_from_token
+from app.limits import ws_message_limiter, ws_send_admission
+from app.cache import (
+    group_cache, get_group_membership, invalidate_group, invalidate_groups_of_member, invalidate_user
+)
+from app.messages.broker import Broker, create_broker
+from app.messages.codec import JSON, Frame, WireFormat, decode_message, negotiate
+from app.metrics import (
+    DELIVERY_LATENCY, FANOUT_DURATION, FANOUT_RECIPIENTS, REPLAY_MESSAGES, UPLOAD_DURATION, WS_ACTIVE_USERS,
+    WS_CONNECTIONS, WS_OUTBOUND_QUEUED, WS_OUTBOUND_QUEUE_MAX, WS_REAPED_CONNECTIONS, WS_REPLAYS_IN_PROGRESS,
+    WS_SKIPPED_FRAMES
+)
+from app.messages.storage import S3Storage, create_storage, sniff_content_type, EXTENSIONS
+from app.messages.model import UploadSlotRequest, UploadConfirm
+from app.utils import create_upload_slot_token, verify_upload_slot_token, revoke_user_tokens
+from app.messages.watermarks import (
+    next_seq, load_watermarks, save_watermarks, purge_group_messages
+)
+from bson import ObjectId
 from config import settings
 from database import groups_collection, messages_collection
-from typing import Dict
-import boto3
+from typing import Dict, Iterator, Optional, Set
 
 # Router for message endpoints
 message_router = APIRouter()
 
-# Create boto3 client
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=settings.aws_access_key,
-    aws_secret_access_key=settings.aws_secret_access_key,
-    region_name=settings.aws_region
-)
+# Attachment storage (S3, local disk or memory)
+storage = create_storage()
+
+# Per-process state dropped on every node when it changes: kind -> local invalidation
+INVALIDATIONS = {
+    "group": invalidate_group,
+    "groups_of_member": invalidate_groups_of_member,
+    "user": invalidate_user,
+    "user_tokens": revoke_user_tokens,
+}
+
+class QueueClosed(Exception):
+    """
+    Raised to a producer waiting on, or putting into, the outbound queue of a closed connection
+    """
+
+class OutboundQueue:
+    """
+    Bounded FIFO of one connection's outbound frames, read by its writer task only.
+    Holds one deque, created on first use, where asyncio.Queue allocates three deques and an event per socket.
+    """
+
+    __slots__ = ("maxsize", "items", "getter", "putters", "closed")
+
+    # Constructor to initialize the queue
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.items: Optional[deque] = None
+        self.getter: Optional[asyncio.Future] = None
+        self.putters: Optional[deque] = None
+        self.closed = False
+
+    def qsize(self) -> int:
+        return len(self.items) if self.items else 0
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= self.qsize()
+
+    # Queue an item, raising asyncio.QueueFull when there is no room
+    def put_nowait(self, item):
+        if self.full():
+            raise asyncio.QueueFull
+        if self.items is None:
+            self.items = deque()
+        self.items.append(item)
+        if self.getter is not None and not self.getter.done():
+            self.getter.set_result(None)
+
+    # Queue an item, waiting for room; raises QueueClosed once the queue is closed, since no writer will make room
+    async def put(self, item):
+        while self.full():
+            if self.closed:
+                raise QueueClosed
+            waiter = asyncio.get_running_loop().create_future()
+            if self.putters is None:
+                self.putters = deque()
+            self.putters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Pass a wake-up this putter can no longer use on to the next one
+                if waiter.done() and not waiter.cancelled():
+                    self.wake_putter()
+                elif waiter in self.putters:
+                    self.putters.remove(waiter)
+                raise
+        if self.closed:
+            raise QueueClosed
+        self.put_nowait(item)
+
+    # Take the oldest item, waiting for one
+    async def get(self):
+        while not self.items:
+            self.getter = asyncio.get_running_loop().create_future()
+            try:
+                await self.getter
+            finally:
+                self.getter = None
+        item = self.items.popleft()
+        self.wake_putter()
+        return item
+
+    def wake_putter(self):
+        while self.putters:
+            waiter = self.putters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    # Stop taking items and wake every waiting producer, which then raises QueueClosed
+    def close(self):
+        self.closed = True
+        while self.putters:
+            waiter = self.putters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+class Connection:
+    """
+    A single WebSocket connection (one device of a user) with a bounded outbound queue drained by its own writer task
+    """
+
+    __slots__ = (
+        "user_id", "websocket", "wire", "queue", "writer_task", "replay_task", "closed", "last_seen", "answers_pings",
+        "watermarks", "flushed", "replay_from", "replay_sent", "stalled"
+    )
+
+    # Constructor to initialize the connection
+    def __init__(self, user_id: str, websocket: WebSocket, wire: WireFormat = JSON):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.wire = wire
+        self.queue = OutboundQueue(settings.ws_outbound_queue_size)
+        self.writer_task: Optional[asyncio.Task] = None
+        self.replay_task: Optional[asyncio.Task] = None
+        self.closed = False
+
+        # Last time the client sent anything, and whether it answers heartbeat pings
+        self.last_seen = time.monotonic()
+        self.answers_pings = False
+
+        # Delivery watermarks (group_id -> seq) sent on this socket, and what was last persisted
+        self.watermarks: Dict[str, int] = {}
+        self.flushed: Dict[str, int] = {}
+
+        # Groups whose backlog is still being replayed, starting after the stored watermark
+        self.replay_from: Dict[str, int] = {}
+        # Seqs above the replay position sent in each group still being replayed, live or replayed
+        self.replay_sent: Dict[str, Set[int]] = {}
+        # Groups where a frame was skipped; their watermark stays put until the next connect
+        self.stalled: Set[str] = set()
+
+    # Record that a group message has gone out on this socket
+    def record_sent(self, group_id: str, seq: int):
+        if group_id in self.stalled:
+            return
+        if group_id in self.replay_from:
+            self.replay_sent.setdefault(group_id, set()).add(seq)
+            return
+        if seq > self.watermarks.get(group_id, 0):
+            self.watermarks[group_id] = seq
+
+    # Record that a group's backlog has been replayed up to seq
+    def record_replayed(self, group_id: str, seq: int, finished: bool = False):
+        if group_id in self.stalled:
+            return
+        self.watermarks[group_id] = max(self.watermarks.get(group_id, 0), seq)
+        sent = self.replay_sent.get(group_id)
+        if finished:
+            self.replay_from.pop(group_id, None)
+            self.replay_sent.pop(group_id, None)
+            self.watermarks[group_id] = max(self.watermarks[group_id], max(sent or (), default=0))
+        elif sent:
+            # Keep only what the replay has still to reach, so the set stays as small as the batch
+            self.replay_sent[group_id] = {sent_seq for sent_seq in sent if sent_seq > seq}
+
+    # Whether a message of a group still being replayed has already gone out, live or replayed
+    def already_sent(self, group_id: str, seq: int) -> bool:
+        sent = self.replay_sent.get(group_id)
+        return sent is not None and seq in sent
+
+    # Watermarks advanced since the last flush
+    def unflushed(self) -> Dict[str, int]:
+        return {group_id: seq for group_id, seq in self.watermarks.items() if self.flushed.get(group_id) != seq}
 
 class ConnectionManager:
     """
@@ -28,155 +202,627 @@ class ConnectionManager:
     """
 
     # Constructor to initialize the connection manager
-    def __init__(self):
-        self.active_users: Dict[str, WebSocket] = {}
+    def __init__(self, broker: Optional[Broker] = None):
+        # Every open connection of each user, one per device
+        self.active_users: Dict[str, Set[Connection]] = {}
+        self.broker = broker or create_broker()
+        self.background_tasks = set()
+
+    # Start routing messages from other nodes to local sockets
+    async def start(self):
+        await self.broker.start(self.deliver_remote)
+
+    # Stop routing messages from other nodes and persist delivery progress
+    async def stop(self):
+        await self.broker.stop()
+        for connection in list(self.connections()):
+            await self.flush_watermarks(connection)
+
+    # All open connections
+    def connections(self) -> Iterator[Connection]:
+        for connections in self.active_users.values():
+            yield from connections
+
+    # Number of open connections, counting every device
+    def connection_count(self) -> int:
+        return sum(len(connections) for connections in self.active_users.values())
+
+    # Run a coroutine in the background, keeping a reference until it finishes
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
 
     # Connect a user to the WebSocket
-    async def connect(self, user_id: str, websocket:WebSocket):
-        await websocket.accept()
-        self.active_users[user_id] = websocket
-
-    # Disconnect a user from the WebSocket
-    def disconnect(self, user_id: str):
-        self.active_users.pop(user_id, None)
-
-    # Delete messages that have been received by all intended recipients
-    async def delete_messages_if_all_received(self):
-        # Delete messages
-        await messages_collection.delete_many({
-            "$expr": {"$eq": [{"$size": "$received_by"}, {"$size": "$intended_for"}]}
-        })
-
-    # Send a message to a specific group
-    async def send_message_to_group(self, group_id: str, sender: dict, message: str):
-        # Find the group in the database
-        group = await groups_collection.find_one({"_id": ObjectId(group_id)})
-        if not group:
+    async def connect(self, user_id: str, websocket:WebSocket, wire: Optional[WireFormat] = None) -> Connection:
+        # Echo the negotiated subprotocol; without one the socket speaks JSON
+        await websocket.accept(subprotocol=wire.name if wire else None)
+        connection = Connection(user_id, websocket, wire or JSON)
+
+        # Every group starts in replay from its stored watermark, before any live frame can arrive
+        group_cursor = groups_collection.find({"members": user_id}, {"_id": 1})
+        group_ids = [str(group["_id"]) async for group in group_cursor]
+        stored = await load_watermarks(user_id)
+        connection.replay_from = {group_id: stored.get(group_id, 0) for group_id in group_ids}
+        connection.watermarks = dict(connection.replay_from)
+        connection.flushed = dict(connection.replay_from)
+
+        connection.writer_task = asyncio.create_task(self.write_loop(connection))
+
+        # Other devices of the user stay connected; the node is registered with their first one
+        first = user_id not in self.active_users
+        self.active_users.setdefault(user_id, set()).add(connection)
+        if first:
+            # A failed registration must not leave the writer task or the registry entry behind
+            try:
+                await self.broker.register(user_id)
+            except BaseException:
+                self.disconnect(connection)
+                raise
+        return connection
+
+    # Disconnect one connection of a user from the WebSocket
+    def disconnect(self, connection: Connection):
+        connections = self.active_users.get(connection.user_id)
+        if connections is not None and connection in connections:
+            connections.discard(connection)
+            if not connections:
+                del self.active_users[connection.user_id]
+                self.spawn(self.broker.unregister(connection.user_id))
+
+        if not connection.closed:
+            connection.closed = True
+            connection.queue.close()
+            for task in (connection.writer_task, connection.replay_task):
+                if task and task is not asyncio.current_task():
+                    task.cancel()
+            self.spawn(self.flush_watermarks(connection))
+
+    # Drain a connection's outbound queue onto its socket
+    async def write_loop(self, connection: Connection):
+        try:
+            while True:
+                enqueued_at, frame = await connection.queue.get()
+
+                # Replay batch marker: everything queued before it has been sent
+                if isinstance(frame, asyncio.Future):
+                    if not frame.done():
+                        frame.set_result(None)
+                    continue
+
+                # While a group is replayed, a message can be both read from the backlog and fanned out live
+                data = frame.data
+                if "seq" in data and connection.already_sent(data["group_id"], data["seq"]):
+                    continue
+
+                # A message is not echoed to the connection it came from, but that still advances its watermark
+                if frame.origin is not connection:
+                    # Encoded once per wire format, the same payload goes to every recipient
+                    payload = frame.encode(connection.wire)
+                    send = connection.websocket.send_bytes if connection.wire.binary else connection.websocket.send_text
+
+                    # A half-open socket must not hold its writer forever
+                    await asyncio.wait_for(send(payload), settings.ws_send_timeout_seconds)
+                    if enqueued_at is not None:
+                        DELIVERY_LATENCY.observe(time.perf_counter() - enqueued_at)
+
+                if "seq" in data:
+                    connection.record_sent(data["group_id"], data["seq"])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Only this connection is affected; close it so its receive loop ends too
+            self.spawn(self.close_connection(connection, 1011))
+
+    # Close a connection that is slow, dead or broken
+    async def close_connection(self, connection: Connection, code: int):
+        self.disconnect(connection)
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=code), settings.ws_send_timeout_seconds)
+        except Exception:
+            pass
+
+    # Queue a reply to the client's own frame (ack, pong, error) without waiting. A client too far behind to take
+    # it is closed rather than waited on: with its writer stuck, nothing would ever make room.
+    def reply(self, connection: Connection, data: dict) -> bool:
+        """
+        Returns True if the reply was queued, False if the connection is closed or being closed
+        """
+
+        if connection.closed:
+            return False
+
+        try:
+            connection.queue.put_nowait((None, Frame(data)))
+            return True
+        except asyncio.QueueFull:
+            self.spawn(self.close_connection(connection, 1013))
+            return False
+
+    # Queue a live group message for a connection without waiting, applying the slow-consumer policy when full
+    def enqueue(self, connection: Connection, frame: Frame) -> bool:
+        """
+        Returns True if the frame was queued, False if the slow-consumer policy kicked in.
+        Only these frames carry their enqueue time, which the writer turns into DELIVERY_LATENCY;
+        replies, pings and replayed messages are queued with None.
+        """
+
+        if connection.closed:
+            return False
+
+        try:
+            connection.queue.put_nowait((time.perf_counter(), frame))
+            return True
+        except asyncio.QueueFull:
+            policy = settings.ws_slow_consumer_policy
+            WS_SKIPPED_FRAMES.labels(policy).inc()
+            if policy == "disconnect":
+                self.spawn(self.close_connection(connection, 1013))
+            elif policy == "spill":
+                # Keep the watermark below the skipped frame so it is replayed on reconnect
+                connection.stalled.add(frame.data["group_id"])
+            return False
+
+    # Persist a connection's advanced watermarks
+    async def flush_watermarks(self, connection: Connection):
+        watermarks = connection.unflushed()
+        if not watermarks:
             return
+        await save_watermarks(connection.user_id, watermarks)
+        connection.flushed.update(watermarks)
 
-        # Check if the sender is a member of the group
-        if sender["_id"] not in group["members"]:
-            return
+    # Periodically persist watermarks of all open connections
+    async def run_watermark_flush_loop(self):
+        while True:
+            await asyncio.sleep(settings.watermark_flush_interval_seconds)
+            for connection in list(self.connections()):
+                try:
+                    await self.flush_watermarks(connection)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print("Watermark flush failed:", e)
+
+    # Ping every connection and close the ones that stopped answering
+    def heartbeat(self) -> int:
+        """
+        Only clients that have answered a ping are held to ws_idle_timeout_seconds;
+        others are covered by the server's protocol-level pings. Returns the number of connections reaped.
+        """
+
+        now = time.monotonic()
+        ping = Frame({"type": "ping"})
+        reaped = 0
+        for connection in list(self.connections()):
+            idle = now - connection.last_seen
+            if connection.answers_pings and settings.ws_idle_timeout_seconds and idle > settings.ws_idle_timeout_seconds:
+                reaped += 1
+                self.spawn(self.close_connection(connection, 1001))
+                continue
 
-        # Store the message in the database
-        msg_doc = {
-            "group_id": group_id,
-            "group_name": group["name"],
-            "sender_id": sender["_id"],
-            "sender_username": sender["username"],
-            "message": message,
-            "received_by": [sender["_id"]],
-            "intended_for": group["members"],
-            "created_at": datetime.now(timezone.utc)
-        }
-        msg_insert_result = await messages_collection.insert_one(msg_doc)
+            # A full queue means the client is not reading; it will be reaped rather than pinged
+            try:
+                connection.queue.put_nowait((None, ping))
+            except asyncio.QueueFull:
+                pass
 
-        # Send the message to all active members of the group
-        received_by = []
+        WS_REAPED_CONNECTIONS.inc(reaped)
+        return reaped
 
-        for member_id in group["members"]:
-            if member_id in self.active_users and member_id != sender["_id"]:
-                # Send the message
-                await self.active_users[member_id].send_json({
+    # Periodically ping connections and reap idle ones
+    async def run_heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(settings.ws_heartbeat_interval_seconds)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print("Heartbeat failed:", e)
+
+    # Delete messages every member of their group has received, one group at a time
+    async def purge_delivered_messages(self) -> int:
+        deleted = 0
+        groups_cursor = groups_collection.find({}, {"members": 1}).batch_size(settings.message_purge_batch_size)
+        async for group in groups_cursor:
+            deleted += await purge_group_messages(group)
+        return deleted
+
+    # Periodically sweep delivered messages, off the request path
+    async def run_purge_loop(self):
+        while True:
+            try:
+                await self.purge_delivered_messages()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Delivered message purge failed:", e)
+            await asyncio.sleep(settings.message_purge_interval_seconds)
+
+    # Send a batch of messages, possibly to several groups, and return one ack per message
+    async def send_messages(self, sender: dict, items: list, origin: Optional[Connection] = None) -> list:
+        """
+        items: [{"group_id": str, "message": str, "client_id": optional}]
+        origin: the sender's connection, which is not sent its own messages back; the sender's other devices are
+        Acks, in the same order: {"client_id", "group_id", "seq"} or {"client_id", "error"}
+        """
+
+        acks = [{"client_id": item.get("client_id")} for item in items]
+        accepted: Dict[str, list] = {}
+        groups: Dict[str, dict] = {}
+
+        for index, item in enumerate(items):
+            group_id = item.get("group_id")
+            if not isinstance(group_id, str) or not ObjectId.is_valid(group_id) or not isinstance(item.get("message"), str):
+                acks[index]["error"] = "invalid"
+                continue
+
+            # Find the group membership (cached)
+            group = await get_group_membership(group_id)
+            if not group:
+                acks[index]["error"] = "group_not_found"
+                continue
+
+            # Check if the sender is a member of the group
+            if sender["_id"] not in group["member_set"]:
+                acks[index]["error"] = "not_a_member"
+                continue
+
+            accepted.setdefault(group_id, []).append(index)
+            groups[group_id] = group
+
+        if not accepted:
+            return acks
+
+        # Number and store the messages before anyone can see them, so replay never misses them
+        created_at = datetime.now(timezone.utc)
+        documents = []
+        for group_id, indexes in list(accepted.items()):
+            first_seq = await next_seq(group_id, len(indexes))
+
+            # The group was deleted after its membership was cached, or while this batch was being checked
+            if first_seq is None:
+                group_cache.invalidate(group_id)
+                for index in indexes:
+                    acks[index]["error"] = "group_not_found"
+                del accepted[group_id]
+                continue
+
+            for offset, index in enumerate(indexes):
+                documents.append({
                     "group_id": group_id,
-                    "group_name": group["name"],
+                    "seq": first_seq + offset,
+                    "group_name": groups[group_id]["name"],
                     "sender_id": sender["_id"],
                     "sender_username": sender["username"],
-                    "message": message,
-                    "created_at": msg_doc["created_at"].isoformat()
+                    "message": items[index]["message"],
+                    "created_at": created_at
                 })
-                received_by.append(member_id)
-
-        # Mark the message as delivered
-        await messages_collection.update_one(
-            {"_id": msg_insert_result.inserted_id},
-            {"$addToSet": {"received_by": {"$each": received_by}}}
-        )
-
-        # Delete messages if all intended recipients have received it
-        await self.delete_messages_if_all_received()
-
-    # Check and send undelivered messages to a user
-    async def check_undelivered_messages(self, user_id: str):
-        # Find the all groups the user is a member of
-        group_cursor = groups_collection.find({"members": {"$in": [user_id]}}, {"_id": 1})
-        groups = await group_cursor.to_list(length=None)
-        group_ids = [str(group["_id"]) for group in groups]
-
-        # Find undelivered messages for the user
-        messages_cursor = messages_collection.find(
-            {"group_id": {"$in": group_ids}, "received_by": {"$ne": user_id}})
-        messages = await messages_cursor.to_list(length=None)
-
-        # Send the undelivered message
-        for message in messages:
-            print("Sending undelivered message to user:", user_id,"this : ",message["message"])
-            await self.active_users[user_id].send_json({
-                "group_id": message["group_id"],
-                "group_name": message["group_name"],
-                "sender_id": message["sender_id"],
-                "sender_username": message["sender_username"],
-                "message": message["message"],
-                "created_at": message["created_at"].isoformat()
-            })
-
-        # Mark the messages as delivered
-        ids = [message["_id"] for message in messages]
-        if ids:
-            await messages_collection.update_many(
-                {"_id": {"$in": ids}},
-                {"$addToSet": {"received_by": user_id}}
+                acks[index].update({"group_id": group_id, "seq": first_seq + offset})
+
+        if not documents:
+            return acks
+        await messages_collection.insert_many(documents, ordered=False)
+
+        # Fan the batch out together
+        for group_id, indexes in accepted.items():
+            group = groups[group_id]
+            frames = [
+                {
+                    "group_id": group_id,
+                    "seq": acks[index]["seq"],
+                    "group_name": group["name"],
+                    "sender_id": sender["_id"],
+                    "sender_username": sender["username"],
+                    "message": items[index]["message"],
+                    "created_at": created_at.isoformat()
+                }
+                for index in indexes
+            ]
+            await self.fan_out(group, sender["_id"], frames, origin)
+
+        return acks
+
+    # Queue frames of one group for every connection of its active members and route them to other nodes
+    async def fan_out(self, group: dict, sender_id: str, frames: list, origin: Optional[Connection] = None):
+        started = time.perf_counter()
+        elsewhere = []
+
+        # One shared frame per message, so each is serialized once however many connections receive it
+        shared = [Frame(frame, origin) for frame in frames]
+        local_users = set()
+        for member_id in group["members"]:
+            connections = self.active_users.get(member_id)
+            if connections:
+                local_users.add(member_id)
+                for connection in connections:
+                    for frame in shared:
+                        self.enqueue(connection, frame)
+
+            # The sender may have other devices on other nodes
+            if not connections or member_id == sender_id:
+                elsewhere.append(member_id)
+
+        duration = time.perf_counter() - started
+        FANOUT_DURATION.observe(duration)
+
+        # Route the messages to the other nodes holding sockets of the remaining members
+        located = await self.broker.locate(elsewhere)
+        for node_id, recipients in located.items():
+            await self.broker.publish(node_id, {"recipients": recipients, "frames": frames})
+
+        # Counted in users, wherever their sockets are; a user on several nodes counts once
+        reached = local_users.union(*located.values())
+        reached.discard(sender_id)
+        for _ in frames:
+            FANOUT_RECIPIENTS.observe(len(reached))
+
+    # Drop cached state here and on every other node, so no node keeps serving it (see INVALIDATIONS)
+    async def invalidate(self, kind: str, key: str):
+        INVALIDATIONS[kind](key)
+        await self.broker.broadcast({"invalidate": kind, "key": key})
+
+    # Deliver a message published by another node to the local sockets of its recipients
+    async def deliver_remote(self, envelope: dict):
+        if "invalidate" in envelope:
+            INVALIDATIONS[envelope["invalidate"]](envelope["key"])
+            return
+
+        started = time.perf_counter()
+        frames = [Frame(frame) for frame in (envelope["frames"] if "frames" in envelope else [envelope["frame"]])]
+        for user_id in envelope["recipients"]:
+            for connection in self.active_users.get(user_id, ()):
+                for frame in frames:
+                    self.enqueue(connection, frame)
+
+        duration = time.perf_counter() - started
+        FANOUT_DURATION.observe(duration)
+
+    # Check and send undelivered messages to a connection
+    async def check_undelivered_messages(self, connection: Connection):
+        if connection.closed:
+            return
+
+        try:
+            replayed = await self.replay(connection)
+        except QueueClosed:
+            return
+        REPLAY_MESSAGES.observe(replayed)
+
+    # Replay every group's backlog above its stored watermark, returning the number of messages sent
+    async def replay(self, connection: Connection) -> int:
+        # One query for the groups' last seqs, read now that live delivery reaches the connection:
+        # anything numbered later arrives live, so a group whose watermark is already there has no backlog
+        last_seqs = {
+            str(group["_id"]): group.get("last_seq", 0)
+            async for group in groups_collection.find(
+                {"_id": {"$in": [ObjectId(group_id) for group_id in connection.replay_from]}}, {"last_seq": 1}
             )
+        }
+        for group_id, after_seq in list(connection.replay_from.items()):
+            if last_seqs.get(group_id, 0) <= after_seq:
+                connection.record_replayed(group_id, after_seq, finished=True)
+
+        # Range-scan each remaining group above the stored watermark, one bounded batch at a time
+        batch_size = settings.replay_batch_size
+        replayed = 0
+        for group_id, after_seq in list(connection.replay_from.items()):
+            while not connection.closed:
+                started = time.monotonic()
+                messages = await messages_collection.find(
+                    {"group_id": group_id, "seq": {"$gt": after_seq}}
+                ).sort("seq", 1).limit(batch_size).to_list(length=batch_size)
+
+                # Queue the batch behind any live traffic, waiting for room so nothing is lost
+                for message in messages:
+                    await connection.queue.put((None, Frame({
+                        "group_id": message["group_id"],
+                        "seq": message["seq"],
+                        "group_name": message["group_name"],
+                        "sender_id": message["sender_id"],
+                        "sender_username": message["sender_username"],
+                        "message": message["message"],
+                        "created_at": message["created_at"].isoformat()
+                    })))
+
+                # Wait until the writer has actually sent the batch, then advance the watermark
+                sent = asyncio.get_running_loop().create_future()
+                await connection.queue.put((None, sent))
+                await sent
+
+                finished = len(messages) < batch_size
+                if messages:
+                    after_seq = messages[-1]["seq"]
+                connection.record_replayed(group_id, after_seq, finished=finished)
+                await self.flush_watermarks(connection)
+                replayed += len(messages)
+
+                if finished:
+                    break
+
+                # Replay-rate limit
+                if settings.replay_rate_limit > 0:
+                    await asyncio.sleep(max(0.0, len(messages) / settings.replay_rate_limit - (time.monotonic() - started)))
+
+        return replayed
 
 # Instantiate the connection manager
 manager = ConnectionManager()
+WS_ACTIVE_USERS.set_function(lambda: len(manager.active_users))
+WS_CONNECTIONS.set_function(manager.connection_count)
+WS_OUTBOUND_QUEUED.set_function(lambda: sum(connection.queue.qsize() for connection in manager.connections()))
+WS_OUTBOUND_QUEUE_MAX.set_function(lambda: max((connection.queue.qsize() for connection in manager.connections()), default=0))
+WS_REPLAYS_IN_PROGRESS.set_function(
+    lambda: sum(1 for connection in manager.connections() if connection.replay_task and not connection.replay_task.done())
+)
 
 @message_router.post('/upload')
-async def upload_file(access_token: str, file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...), user_payload: dict = Depends(get_limited_user_from_token)):
     """
     Endpoint to upload a file
+    Query: access_token
     """
 
     # Check if the file is provided
     if not file:
         raise HTTPException(status_code=400, detail="No file uploaded")
 
-    # Check if the user is authenticated
-    user_payload = get_current_user_from_token(access_token)
-    if not user_payload:
-        raise HTTPException(status_code=401, detail="Invalid access token")
+    # Check the file type from its first bytes
+    chunk = await file.read(settings.upload_chunk_bytes)
+    file_type = sniff_content_type(chunk)
+    if file_type is None:
+        raise HTTPException(status_code=400, detail="Unsupported file type")
 
-    # Check the file size
-    contents = await file.read()
-    size = len(contents)
-    if not 0 < size <= 10 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File size must be between 0 and 10MB")
+    # Generate unique filename with the extension of the sniffed type, never the client's
+    unique_filename = f"{uuid4()}{EXTENSIONS[file_type]}"
+
+    # Copy the spooled file to storage chunk by chunk; BodyLimitMiddleware has already capped the request size
+    started = time.perf_counter()
+    upload = await storage.open_upload(unique_filename, file_type)
+    size = 0
+    outcome = "error"
+    try:
+        while chunk:
+            size += len(chunk)
+            if size > settings.upload_max_bytes:
+                raise HTTPException(status_code=400, detail="File size must be between 0 and 10MB")
+            await upload.write(chunk)
+            chunk = await file.read(settings.upload_chunk_bytes)
+
+        if size == 0:
+            raise HTTPException(status_code=400, detail="File size must be between 0 and 10MB")
+
+        url = await upload.complete()
+        outcome = "ok"
+    except BaseException:
+        await upload.abort()
+        raise
+    finally:
+        UPLOAD_DURATION.labels(settings.storage_backend, "proxy", outcome).observe(time.perf_counter() - started)
+
+    return {
+        "type": "file",
+        "filename": file.filename,
+        "url": url
+    }
+
+@message_router.post("/upload-slot")
+async def create_upload_slot(body: UploadSlotRequest, user_payload: dict = Depends(get_limited_user_from_token)):
+    """
+    Endpoint to reserve a direct-to-storage upload
+    Query: access_token
+    Returns where to upload the file and the slot_token to confirm it with. The upload is either
+    {"method": "PUT", "url", "headers"} or, for S3, {"method": "POST", "url", "fields"}: a multipart form
+    with the fields followed by the file. It lands on a private staging key until it is confirmed.
+    """
 
-    # Check the file type
-    file_type = file.content_type
-    if file_type not in ["image/png", "image/jpg", "image/jpeg", "application/pdf"]:
+    # Check the declared size and type
+    if not 0 < body.size <= settings.upload_max_bytes:
+        raise HTTPException(status_code=400, detail="File size must be between 0 and 10MB")
+    if body.content_type not in EXTENSIONS:
         raise HTTPException(status_code=400, detail="Unsupported file type")
 
-    # Generate unique filename while preserving extension
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid4()}{file_extension}"
+    # Generate unique filename with the extension of the declared type, which confirmation checks against the bytes
+    unique_filename = f"{uuid4()}{EXTENSIONS[body.content_type]}"
 
-    # Rewind the stream for the actual upload
-    file.file.seek(0)
+    staging_key = f"{settings.upload_staging_prefix}{uuid4()}"
 
-    # Upload using threadpool (boto3 is sync)
-    await run_in_threadpool(
-        s3_client.upload_fileobj,
-        file.file,
-        settings.s3_bucket_name,
-        unique_filename,
-        {"ContentType": file_type},
-    )
+    slot_token = create_upload_slot_token({
+        "_id": user_payload["_id"],
+        "key": unique_filename,
+        "staging_key": staging_key,
+        "filename": body.filename,
+        "size": body.size,
+        "content_type": body.content_type
+    })
+    upload = await storage.presign_upload(staging_key, body.content_type, body.size, slot_token)
+
+    return {
+        "slot_token": slot_token,
+        "upload": upload,
+        "constraints": {
+            "size": body.size,
+            "content_type": body.content_type,
+            "expires_in": settings.upload_slot_expire_seconds
+        }
+    }
+
+@message_router.put("/direct-upload/{key:path}")
+async def direct_upload(key: str, slot_token: str, request: Request):
+    """
+    Local stand-in for a presigned storage PUT, used when storage is not S3
+    Each slot takes a single upload
+    """
+
+    if isinstance(storage, S3Storage):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    slot = verify_upload_slot_token(slot_token)
+    if not slot or slot.get("staging_key") != key:
+        raise HTTPException(status_code=403, detail="Invalid upload slot")
+    if await storage.stat(key) is not None or await storage.stat(slot["key"]) is not None:
+        raise HTTPException(status_code=409, detail="Upload slot already used")
+
+    # Stream the body to storage, refusing anything larger than declared
+    started = time.perf_counter()
+    try:
+        upload = await storage.open_upload(key, slot["content_type"])
+    except FileExistsError:
+        raise HTTPException(status_code=409, detail="Upload slot already used")
+    size = 0
+    outcome = "error"
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > slot["size"]:
+                raise HTTPException(status_code=400, detail="Upload larger than declared")
+            await upload.write(chunk)
+        await upload.complete()
+        outcome = "ok"
+    except FileExistsError:
+        await upload.abort()
+        raise HTTPException(status_code=409, detail="Upload slot already used")
+    except BaseException:
+        await upload.abort()
+        raise
+    finally:
+        UPLOAD_DURATION.labels(settings.storage_backend, "direct", outcome).observe(time.perf_counter() - started)
+
+    return Response(status_code=200)
+
+@message_router.post("/upload-confirm")
+async def confirm_upload(body: UploadConfirm, user_payload: dict = Depends(get_limited_user_from_token)):
+    """
+    Endpoint to confirm a direct-to-storage upload
+    Query: access_token
+    """
+
+    slot = verify_upload_slot_token(body.slot_token)
+    if not slot or slot["_id"] != user_payload["_id"] or "staging_key" not in slot:
+        raise HTTPException(status_code=403, detail="Invalid upload slot")
+    if await storage.stat(slot["key"]) is not None:
+        raise HTTPException(status_code=409, detail="Upload already confirmed")
+
+    # Check the staged object against what was declared
+    stored = await storage.stat(slot["staging_key"])
+    if stored is None:
+        raise HTTPException(status_code=400, detail="File has not been uploaded")
+
+    head = await storage.read_head(slot["staging_key"], 16)
+    if (
+        stored["size"] != slot["size"]
+        or stored["content_type"] not in (None, slot["content_type"])
+        or sniff_content_type(head) != slot["content_type"]
+    ):
+        await storage.delete(slot["staging_key"])
+        raise HTTPException(status_code=400, detail="Uploaded file does not match the declared size or type")
+
+    # Only a verified object reaches its public key; later writes to the staging key go nowhere
+    await storage.promote(slot["staging_key"], slot["key"])
 
     return {
         "type": "file",
-        "filename": file.filename,
-        "url": f"https://{settings.s3_bucket_name}.s3.{settings.aws_region}.amazonaws.com/{unique_filename}"
+        "filename": slot["filename"],
+        "url": storage.url_for(slot["key"])
     }
 
 @message_router.websocket("/ws")
@@ -184,27 +830,109 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
     """
     WebSocket endpoint for real-time messaging
     Header: Authorization (Bearer <token>)
-    Message JSON: {"group_id": str, "message": str}
+    Header: Sec-WebSocket-Protocol (optional): "msgpack" for binary MessagePack frames, "json" (default) for text
+    Message JSON: {"group_id": str, "message": str, "client_id": optional}
+    Batch JSON: {"batch": [{"group_id": str, "message": str, "client_id": optional}, ...]}, at most ws_max_batch_size
+    and ws_message_burst_per_user items; a larger batch gets {"type": "error", "detail": "Batch too large"}
+    When client_ids are given the server replies {"type": "ack", "acks": [{"client_id", "group_id", "seq"} | {"client_id", "error"}]}
+    Heartbeat: the server sends {"type": "ping"} every ws_heartbeat_interval_seconds; clients answering {"type": "pong"}
+    are closed after ws_idle_timeout_seconds without any frame. Clients may send {"type": "ping"} to get a pong.
+    Each device keeps its own connection; a message is delivered to all of them except the one it was sent from.
+    On connect, messages above the stored watermark are replayed interleaved with live ones, and a message read
+    from the backlog and fanned out live is sent once. One fanned out late can still repeat after a replay batch
+    has moved past it or across reconnects, so clients dedupe by (group_id, seq).
+    Limits: sends beyond ws_message_rate_per_user, or while ws_max_concurrent_sends are in flight, are not stored;
+    the server replies {"type": "throttled", "reason": "rate_limited" | "overloaded", "retry_after": seconds, "client_ids": [...]}.
+    Once ws_max_connections sockets are open, new ones are refused with close code 1013 (try again later).
     """
 
     # Retrieve the current user from the JWT token
-    user_payload = get_current_user_from_token(token)
+    user_payload = await get_current_user_from_token(token)
 
-    # Connect the user to the WebSocket (Connect)
-    await manager.connect(user_payload["_id"], websocket)
+    # Shed new sockets once the process holds as many as it is sized for. The handshake is completed first:
+    # closing before accept() would answer HTTP 403 and the client would never see 1013.
+    if settings.ws_max_connections and manager.connection_count() >= settings.ws_max_connections:
+        await websocket.accept()
+        await websocket.close(code=1013)
+        return
 
-    # Check and send undelivered messages
-    await manager.check_undelivered_messages(user_payload["_id"])
+    # Connect the user to the WebSocket, in the wire format the client prefers (Connect)
+    wire = negotiate(websocket.scope.get("subprotocols", []))
+    connection = await manager.connect(user_payload["_id"], websocket, wire)
 
-    # Listen for incoming messages (Message)
+    # Replay undelivered messages in the background, interleaved with live traffic
+    connection.replay_task = manager.spawn(manager.check_undelivered_messages(connection))
+
+    # Listen for incoming messages (Message), until the client leaves or the server closes the connection
     try:
-        while True:
-            data = await websocket.receive_json()
-            if not "group_id" in data or not "message" in data:
+        while not connection.closed:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            connection.last_seen = time.monotonic()
+
+            try:
+                data = decode_message(connection.wire, message)
+            except ValueError:
+                if not manager.reply(connection, {"type": "error", "detail": "Malformed frame"}):
+                    break
+                continue
+            if not isinstance(data, dict):
+                continue
+
+            # Heartbeats
+            if data.get("type") == "pong":
+                connection.answers_pings = True
+                continue
+            if data.get("type") == "ping":
+                if not manager.reply(connection, {"type": "pong"}):
+                    break
                 continue
 
-            await manager.send_message_to_group(data["group_id"], user_payload, data["message"])
+            items = data["batch"] if "batch" in data else [data]
+            if not isinstance(items, list) or not items:
+                continue
+            # A batch costs a token per item, so one larger than the user's burst would be throttled forever
+            if len(items) > settings.ws_max_batch_size or not ws_message_limiter.fits(len(items)):
+                if not manager.reply(connection, {"type": "error", "detail": "Batch too large"}):
+                    break
+                continue
+
+            items = [item if isinstance(item, dict) else {} for item in items]
+
+            # Admission first, so a client is not charged for sends the server sheds; refused items are not stored
+            throttle = None
+            if not ws_send_admission.try_acquire():
+                throttle = ("overloaded", settings.overload_retry_after_seconds)
+            else:
+                retry_after = ws_message_limiter.acquire(user_payload["_id"], len(items))
+                if retry_after:
+                    ws_send_admission.release()
+                    throttle = ("rate_limited", retry_after)
+            if throttle:
+                reason, retry_after = throttle
+                if not manager.reply(connection, {
+                    "type": "throttled",
+                    "reason": reason,
+                    "retry_after": round(retry_after, 3),
+                    "client_ids": [item["client_id"] for item in items if item.get("client_id") is not None]
+                }):
+                    break
+                continue
+
+            try:
+                acks = await manager.send_messages(user_payload, items, connection)
+            finally:
+                ws_send_admission.release()
+
+            # Acknowledge only clients that track their outbox with client ids
+            if any(item.get("client_id") is not None for item in items):
+                if not manager.reply(connection, {"type": "ack", "acks": acks}):
+                    break
 
     # Handle disconnection (Disconnect)
     except WebSocketDisconnect:
-        manager.disconnect(user_payload["_id"])
+        pass
+    finally:
+        manager.disconnect(connection)
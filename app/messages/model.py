@@ -0,0 +1,11 @@
+from pydantic import BaseModel
+
+# Upload slot request schema
+class UploadSlotRequest(BaseModel):
+    filename: str
+    size: int
+    content_type: str
+
+# Upload confirmation schema
+class UploadConfirm(BaseModel):
+    slot_token: str
@@ -0,0 +1,416 @@
+import os
+import shutil
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+from fastapi.concurrency import run_in_threadpool
+from config import settings
+
+# Allowed attachment types, recognised by their leading bytes
+MAGIC_NUMBERS = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"%PDF-", "application/pdf"),
+]
+
+# Extension stored objects get for each allowed type, so they are served as what they were sniffed as
+EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "application/pdf": ".pdf",
+}
+
+def sniff_content_type(head: bytes) -> Optional[str]:
+    """
+    Detect the content type from the first bytes of a file, or None if it is not allowed
+    """
+
+    for magic, content_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return content_type
+    return None
+
+class Upload(ABC):
+    """
+    An object being written to storage chunk by chunk
+    """
+
+    # Append a chunk
+    @abstractmethod
+    async def write(self, chunk: bytes):
+        ...
+
+    # Finish the object and return its URL
+    @abstractmethod
+    async def complete(self) -> str:
+        ...
+
+    # Discard everything written so far
+    @abstractmethod
+    async def abort(self):
+        ...
+
+class StorageBackend(ABC):
+    """
+    Where uploaded attachments are stored
+    """
+
+    # Start writing a new object
+    @abstractmethod
+    async def open_upload(self, key: str, content_type: str) -> Upload:
+        ...
+
+    # Public URL of a stored object
+    @abstractmethod
+    def url_for(self, key: str) -> str:
+        ...
+
+    # Where and how a client uploads an object of exactly size bytes directly: {"url", "method", "headers"}
+    async def presign_upload(self, key: str, content_type: str, size: int, slot_token: str) -> dict:
+        return {
+            "url": f"{settings.direct_upload_base_url.rstrip('/')}/{key}?slot_token={slot_token}",
+            "method": "PUT",
+            "headers": {"Content-Type": content_type}
+        }
+
+    # Move a confirmed object from its staging key to its final key
+    @abstractmethod
+    async def promote(self, staging_key: str, key: str):
+        ...
+
+    # Size and content type of a stored object, or None if it does not exist
+    @abstractmethod
+    async def stat(self, key: str) -> Optional[dict]:
+        ...
+
+    # First bytes of a stored object
+    @abstractmethod
+    async def read_head(self, key: str, length: int) -> bytes:
+        ...
+
+    # Remove a stored object
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    # Create clients ahead of the first upload
+    async def warm(self):
+        pass
+
+    # Release clients on shutdown
+    async def close(self):
+        pass
+
+class S3Upload(Upload):
+    """
+    Buffers at most one part and pushes it with S3 multipart upload; small objects use a single put
+    """
+
+    # Constructor to initialize the upload
+    def __init__(self, storage: "S3Storage", key: str, content_type: str):
+        self.storage = storage
+        self.key = key
+        self.content_type = content_type
+        self.buffer = bytearray()
+        self.upload_id: Optional[str] = None
+        self.parts: List[dict] = []
+
+    async def write(self, chunk: bytes):
+        self.buffer += chunk
+        while len(self.buffer) >= settings.s3_part_bytes:
+            part = bytes(self.buffer[:settings.s3_part_bytes])
+            del self.buffer[:settings.s3_part_bytes]
+            await self.upload_part(part)
+
+    # Send one part, starting the multipart upload on the first one
+    async def upload_part(self, part: bytes):
+        client = await self.storage.get_client()
+        if self.upload_id is None:
+            response = await run_in_threadpool(
+                client.create_multipart_upload,
+                Bucket=self.storage.bucket, Key=self.key, ContentType=self.content_type
+            )
+            self.upload_id = response["UploadId"]
+
+        number = len(self.parts) + 1
+        response = await run_in_threadpool(
+            client.upload_part,
+            Bucket=self.storage.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=part
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": number})
+
+    async def complete(self) -> str:
+        client = await self.storage.get_client()
+        if self.upload_id is None:
+            await run_in_threadpool(
+                client.put_object,
+                Bucket=self.storage.bucket, Key=self.key, Body=bytes(self.buffer), ContentType=self.content_type
+            )
+        else:
+            if self.buffer:
+                await self.upload_part(bytes(self.buffer))
+            await run_in_threadpool(
+                client.complete_multipart_upload,
+                Bucket=self.storage.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={"Parts": self.parts}
+            )
+        self.buffer = bytearray()
+        return self.storage.url_for(self.key)
+
+    async def abort(self):
+        self.buffer = bytearray()
+        if self.upload_id is not None:
+            client = await self.storage.get_client()
+            await run_in_threadpool(
+                client.abort_multipart_upload,
+                Bucket=self.storage.bucket, Key=self.key, UploadId=self.upload_id
+            )
+
+class S3Storage(StorageBackend):
+    """
+    Attachments in an S3 bucket
+    """
+
+    # Constructor to initialize the bucket; the boto3 client is only built when first needed
+    def __init__(self):
+        self.bucket = settings.s3_bucket_name
+        self.client = None
+        self.client_lock = asyncio.Lock()
+
+    # The shared boto3 client, built in a worker thread on first use
+    async def get_client(self):
+        if self.client is None:
+            async with self.client_lock:
+                if self.client is None:
+                    self.client = await run_in_threadpool(self.create_client)
+        return self.client
+
+    # boto3 is imported here rather than at module load, keeping it out of the app's cold start
+    def create_client(self):
+        import boto3
+        from botocore.config import Config
+
+        return boto3.client(
+            "s3",
+            aws_access_key_id=settings.aws_access_key,
+            aws_secret_access_key=settings.aws_secret_access_key,
+            region_name=settings.aws_region,
+            config=Config(
+                max_pool_connections=settings.s3_max_pool_connections,
+                connect_timeout=settings.s3_connect_timeout_seconds,
+                read_timeout=settings.s3_read_timeout_seconds
+            )
+        )
+
+    async def warm(self):
+        await self.get_client()
+
+    async def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    async def open_upload(self, key: str, content_type: str) -> Upload:
+        return S3Upload(self, key, content_type)
+
+    def url_for(self, key: str) -> str:
+        return f"https://{self.bucket}.s3.{settings.aws_region}.amazonaws.com/{key}"
+
+    # A presigned POST, so the policy pins both the content type and the exact length
+    async def presign_upload(self, key: str, content_type: str, size: int, slot_token: str) -> dict:
+        client = await self.get_client()
+        post = await run_in_threadpool(
+            client.generate_presigned_post,
+            self.bucket, key,
+            Fields={"Content-Type": content_type},
+            Conditions=[{"Content-Type": content_type}, ["content-length-range", size, size]],
+            ExpiresIn=settings.upload_slot_expire_seconds
+        )
+        return {"url": post["url"], "method": "POST", "fields": post["fields"]}
+
+    async def promote(self, staging_key: str, key: str):
+        client = await self.get_client()
+        await run_in_threadpool(
+            client.copy_object,
+            Bucket=self.bucket, Key=key, CopySource={"Bucket": self.bucket, "Key": staging_key}
+        )
+        await run_in_threadpool(client.delete_object, Bucket=self.bucket, Key=staging_key)
+
+    async def stat(self, key: str) -> Optional[dict]:
+        client = await self.get_client()
+        try:
+            head = await run_in_threadpool(client.head_object, Bucket=self.bucket, Key=key)
+        except client.exceptions.ClientError:
+            return None
+        return {"size": head["ContentLength"], "content_type": head.get("ContentType")}
+
+    async def read_head(self, key: str, length: int) -> bytes:
+        client = await self.get_client()
+        response = await run_in_threadpool(
+            client.get_object, Bucket=self.bucket, Key=key, Range=f"bytes=0-{length - 1}"
+        )
+        return await run_in_threadpool(response["Body"].read)
+
+    async def delete(self, key: str):
+        client = await self.get_client()
+        await run_in_threadpool(client.delete_object, Bucket=self.bucket, Key=key)
+
+def remove_file(path: str):
+    """
+    Delete a file if it exists
+    """
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def read_file_head(path: str, length: int) -> bytes:
+    """
+    First bytes of a file
+    """
+
+    with open(path, "rb") as file:
+        return file.read(length)
+
+class LocalUpload(Upload):
+    """
+    Writes chunks to a temporary file that is renamed into place on completion.
+    Every file operation runs on the threadpool, off the event loop.
+    """
+
+    # Constructor to initialize the upload around its already opened part file
+    def __init__(self, storage: "LocalStorage", key: str, path: str, file):
+        self.storage = storage
+        self.key = key
+        self.path = path
+        self.file = file
+
+    async def write(self, chunk: bytes):
+        await run_in_threadpool(self.file.write, chunk)
+
+    async def complete(self) -> str:
+        await run_in_threadpool(self.finish)
+        return self.storage.url_for(self.key)
+
+    # Close the part file and link it into place; linking rather than renaming never replaces an existing object
+    def finish(self):
+        self.file.close()
+        try:
+            os.link(self.path + ".part", self.path)
+        finally:
+            os.remove(self.path + ".part")
+
+    async def abort(self):
+        await run_in_threadpool(self.discard)
+
+    def discard(self):
+        self.file.close()
+        remove_file(self.path + ".part")
+
+class LocalStorage(StorageBackend):
+    """
+    Attachments in a local directory, served by the app under local_storage_base_url;
+    staged direct uploads are kept in a separate directory that is not served
+    """
+
+    # Constructor to initialize the directories
+    def __init__(self, directory: str = None, staging_directory: str = None):
+        self.directory = directory or settings.local_storage_dir
+        self.staging_directory = staging_directory or settings.local_staging_dir
+        os.makedirs(self.directory, exist_ok=True)
+        os.makedirs(self.staging_directory, exist_ok=True)
+
+    # File backing a key: staging keys live outside the served directory
+    def path_for(self, key: str) -> str:
+        if key.startswith(settings.upload_staging_prefix):
+            return os.path.join(self.staging_directory, key[len(settings.upload_staging_prefix):])
+        return os.path.join(self.directory, key)
+
+    async def open_upload(self, key: str, content_type: str) -> Upload:
+        # Exclusive create: a second upload to the same key fails instead of overwriting the first
+        path = self.path_for(key)
+        file = await run_in_threadpool(open, path + ".part", "xb")
+        return LocalUpload(self, key, path, file)
+
+    def url_for(self, key: str) -> str:
+        return f"{settings.local_storage_base_url.rstrip('/')}/{key}"
+
+    async def stat(self, key: str) -> Optional[dict]:
+        try:
+            size = await run_in_threadpool(os.path.getsize, self.path_for(key))
+        except FileNotFoundError:
+            return None
+        return {"size": size, "content_type": None}
+
+    async def read_head(self, key: str, length: int) -> bytes:
+        return await run_in_threadpool(read_file_head, self.path_for(key), length)
+
+    async def delete(self, key: str):
+        await run_in_threadpool(remove_file, self.path_for(key))
+
+    async def promote(self, staging_key: str, key: str):
+        await run_in_threadpool(shutil.move, self.path_for(staging_key), self.path_for(key))
+
+class MemoryUpload(Upload):
+    """
+    Collects chunks in memory
+    """
+
+    # Constructor to initialize the upload
+    def __init__(self, storage: "MemoryStorage", key: str, content_type: str):
+        self.storage = storage
+        self.key = key
+        self.content_type = content_type
+        self.chunks: List[bytes] = []
+
+    async def write(self, chunk: bytes):
+        self.chunks.append(chunk)
+
+    async def complete(self) -> str:
+        self.storage.objects[self.key] = (self.content_type, b"".join(self.chunks))
+        return self.storage.url_for(self.key)
+
+    async def abort(self):
+        self.chunks = []
+
+class MemoryStorage(StorageBackend):
+    """
+    Attachments kept in process memory, for tests and benchmarks
+    """
+
+    # Constructor to initialize the object map
+    def __init__(self):
+        self.objects: Dict[str, tuple] = {}
+
+    async def open_upload(self, key: str, content_type: str) -> Upload:
+        return MemoryUpload(self, key, content_type)
+
+    def url_for(self, key: str) -> str:
+        return f"memory://{key}"
+
+    async def stat(self, key: str) -> Optional[dict]:
+        if key not in self.objects:
+            return None
+        content_type, data = self.objects[key]
+        return {"size": len(data), "content_type": content_type}
+
+    async def read_head(self, key: str, length: int) -> bytes:
+        return self.objects[key][1][:length]
+
+    async def delete(self, key: str):
+        self.objects.pop(key, None)
+
+    async def promote(self, staging_key: str, key: str):
+        self.objects[key] = self.objects.pop(staging_key)
+
+def create_storage() -> StorageBackend:
+    """
+    Build the storage backend selected by settings.storage_backend
+    """
+
+    if settings.storage_backend == "local":
+        return LocalStorage()
+    if settings.storage_backend == "memory":
+        return MemoryStorage()
+    return S3Storage()
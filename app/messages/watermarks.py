@@ -0,0 +1,164 @@
+from typing import Dict, Iterable, Optional
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from database import groups_collection, messages_collection, watermarks_collection
+
+# Delivery model:
+#   groups.last_seq               last sequence number handed out in the group
+#   messages.seq                  position of the message in its group
+#   delivery_watermarks.seq       highest seq delivered to (user_id, group_id);
+#                                 everything at or below it has been delivered
+
+def watermark_id(user_id: str, group_id: str) -> str:
+    return f"{user_id}:{group_id}"
+
+async def next_seq(group_id: str, count: int = 1) -> Optional[int]:
+    """
+    Reserve the next count message sequence numbers of a group and return the first one, or None if the group is gone
+    """
+
+    group = await groups_collection.find_one_and_update(
+        {"_id": ObjectId(group_id)},
+        {"$inc": {"last_seq": count}},
+        projection={"last_seq": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if group is None:
+        return None
+    return group["last_seq"] - count + 1
+
+async def load_watermarks(user_id: str) -> Dict[str, int]:
+    """
+    Return the delivery watermark of a user in each of their groups
+    """
+
+    cursor = watermarks_collection.find({"user_id": user_id}, {"group_id": 1, "seq": 1})
+    return {mark["group_id"]: mark["seq"] async for mark in cursor}
+
+async def advance_watermarks(entries: Iterable[tuple], create: bool = True):
+    """
+    Advance (user_id, group_id, seq) watermarks; never moves one backwards.
+    Without create only existing watermarks move, so one removed with its membership stays removed.
+    """
+
+    updates = [
+        UpdateOne(
+            {"_id": watermark_id(user_id, group_id)},
+            {"$max": {"seq": seq}, "$setOnInsert": {"user_id": user_id, "group_id": group_id}} if create
+            else {"$max": {"seq": seq}},
+            upsert=create
+        )
+        for user_id, group_id, seq in entries
+    ]
+    if updates:
+        await watermarks_collection.bulk_write(updates, ordered=False)
+
+async def save_watermarks(user_id: str, watermarks: Dict[str, int]):
+    """
+    Advance a user's watermarks in several groups; groups they have left since connecting are skipped
+    """
+
+    await advance_watermarks(((user_id, group_id, seq) for group_id, seq in watermarks.items()), create=False)
+
+async def init_member_watermarks(group_id: str, member_ids: Iterable[str]):
+    """
+    Start new members at the group's current seq so they only receive messages sent after joining;
+    members that already have a watermark keep it
+    """
+
+    member_ids = list(member_ids)
+    if not member_ids:
+        return
+
+    group = await groups_collection.find_one({"_id": ObjectId(group_id)}, {"last_seq": 1})
+    last_seq = group.get("last_seq", 0) if group else 0
+    await watermarks_collection.bulk_write([
+        UpdateOne(
+            {"_id": watermark_id(member_id, group_id)},
+            {"$setOnInsert": {"user_id": member_id, "group_id": group_id, "seq": last_seq}},
+            upsert=True
+        )
+        for member_id in member_ids
+    ], ordered=False)
+
+async def remove_watermarks(user_id: str = None, group_id: str = None):
+    """
+    Forget watermarks of a member leaving a group, a deleted user, or a deleted group
+    """
+
+    query = {}
+    if user_id is not None:
+        query["user_id"] = user_id
+    if group_id is not None:
+        query["group_id"] = group_id
+    if query:
+        await watermarks_collection.delete_many(query)
+
+async def purge_group_messages(group: dict) -> int:
+    """
+    Delete a group's messages at or below every current member's watermark
+    """
+
+    members = group.get("members", [])
+    if not members:
+        return 0
+
+    group_id = str(group["_id"])
+    cursor = watermarks_collection.find({"group_id": group_id, "user_id": {"$in": members}}, {"seq": 1})
+    marks = [mark["seq"] async for mark in cursor]
+
+    # A member without a watermark has received nothing yet
+    if len(marks) < len(set(members)):
+        return 0
+
+    result = await messages_collection.delete_many({"group_id": group_id, "seq": {"$lte": min(marks)}})
+    return result.deleted_count
+
+async def migrate_legacy_messages():
+    """
+    Move messages stored with received_by/intended_for arrays onto the seq/watermark model.
+    Safe to run repeatedly: only groups without last_seq and messages without seq are touched.
+    """
+
+    legacy_group_ids = await messages_collection.distinct("group_id", {"seq": {"$exists": False}})
+    groups_cursor = groups_collection.find({"$or": [
+        {"last_seq": {"$exists": False}},
+        {"_id": {"$in": [ObjectId(group_id) for group_id in legacy_group_ids if ObjectId.is_valid(group_id)]}}
+    ]}, {"members": 1, "last_seq": 1})
+
+    async for group in groups_cursor:
+        group_id = str(group["_id"])
+        last_seq = group.get("last_seq", 0)
+
+        # Number legacy messages in insertion order
+        legacy = await messages_collection.find(
+            {"group_id": group_id, "seq": {"$exists": False}}, {"received_by": 1}
+        ).sort("_id", 1).to_list(length=None)
+
+        first_missing: Dict[str, int] = {}
+        updates = []
+        for message in legacy:
+            last_seq += 1
+            updates.append(UpdateOne(
+                {"_id": message["_id"]},
+                {"$set": {"seq": last_seq}, "$unset": {"received_by": "", "intended_for": "", "pending_count": ""}}
+            ))
+            received_by = set(message.get("received_by", []))
+            for member_id in group["members"]:
+                if member_id not in received_by and member_id not in first_missing:
+                    first_missing[member_id] = last_seq
+
+        if updates:
+            await messages_collection.bulk_write(updates, ordered=False)
+        await groups_collection.update_one({"_id": group["_id"]}, {"$max": {"last_seq": last_seq}})
+
+        # Each member has everything before the first legacy message they had not received
+        if legacy:
+            await advance_watermarks(
+                (member_id, group_id, first_missing.get(member_id, last_seq + 1) - 1) for member_id in group["members"]
+            )
+        else:
+            await init_member_watermarks(group_id, group["members"])
+
+    # Legacy messages of groups that no longer exist
+    await messages_collection.delete_many({"seq": {"$exists": False}})
@@ -0,0 +1,158 @@
+import time
+from typing import Dict, Tuple
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+from starlette.responses import Response
+
+# HTTP
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template",
+    ["method", "route", "status"]
+)
+
+# Rate limiting and admission control
+RATE_LIMITED = Counter("rate_limited_total", "Requests and WebSocket frames refused by a rate limiter", ["limiter"])
+RATE_LIMIT_KEYS = Gauge("rate_limit_keys", "Users or client IPs a rate limiter holds a bucket for", ["limiter"])
+SHED_LOAD = Counter("shed_load_total", "Work refused because a global concurrency cap was reached", ["limit"])
+ADMISSION_IN_FLIGHT = Gauge("admission_in_flight", "Work in flight under a global concurrency cap", ["limit"])
+
+# Password hashing
+PASSWORD_POOL_IN_FLIGHT = Gauge("password_pool_in_flight", "bcrypt jobs running or waiting for a pool worker")
+PASSWORD_POOL_WAIT = Histogram(
+    "password_pool_wait_seconds", "Time a bcrypt job waits for a pool worker",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+PASSWORD_POOL_RUN = Histogram(
+    "password_pool_run_seconds", "Time a bcrypt job runs on a pool worker",
+    buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.5)
+)
+
+# In-process caches
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by cache and result", ["cache", "result"])
+CACHE_SIZE = Gauge("cache_entries", "Entries held by an in-process cache", ["cache"])
+
+# MongoDB
+MONGO_COMMAND_DURATION = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command duration by collection and command",
+    ["collection", "command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongo_command_failures_total", "Failed MongoDB commands by collection and command",
+    ["collection", "command"]
+)
+
+# WebSocket delivery
+WS_ACTIVE_USERS = Gauge("ws_active_users", "Users with an open WebSocket on this process")
+WS_CONNECTIONS = Gauge("ws_connections", "Open WebSocket connections on this process, counting every device")
+WS_REAPED_CONNECTIONS = Counter("ws_reaped_connections_total", "Connections closed for missing heartbeats")
+WS_OUTBOUND_QUEUED = Gauge("ws_outbound_queued_frames", "Frames waiting in outbound queues")
+WS_OUTBOUND_QUEUE_MAX = Gauge("ws_outbound_queue_max_frames", "Frames waiting in the fullest outbound queue")
+WS_REPLAYS_IN_PROGRESS = Gauge("ws_replays_in_progress", "Connections still being replayed undelivered messages")
+WS_SKIPPED_FRAMES = Counter(
+    "ws_skipped_frames_total", "Frames not queued because an outbound queue was full, by slow-consumer policy",
+    ["policy"]
+)
+FANOUT_RECIPIENTS = Histogram(
+    "message_fanout_recipients", "Members other than the sender a group message is delivered to, on any node",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+)
+FANOUT_DURATION = Histogram(
+    "message_fanout_duration_seconds", "Time to queue a batch of group messages for local members",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+)
+DELIVERY_LATENCY = Histogram(
+    "message_delivery_latency_seconds",
+    "Time a live group message waits in an outbound queue before it is written to the socket",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+REPLAY_MESSAGES = Histogram(
+    "message_replay_size", "Undelivered messages replayed to a connecting socket",
+    buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+)
+
+# Audit logs
+AUDIT_LOG_ENTRIES = Counter(
+    "audit_log_entries_total", "Audit log entries by what the writer did with them",
+    ["outcome"]  # enqueued, flushed, dropped, failed, rollup_failed
+)
+AUDIT_LOG_QUEUED = Gauge("audit_log_queued_entries", "Audit log entries waiting for the writer")
+AUDIT_LOG_ARCHIVED = Counter("audit_log_archived_entries_total", "Raw audit log entries written to the archive")
+AUDIT_LOG_ARCHIVE_DOCUMENTS = Counter("audit_log_archive_documents_total", "Archive documents written")
+AUDIT_LOG_COMPACTIONS = Counter("audit_log_compactions_total", "Completed audit log compaction runs")
+AUDIT_LOG_ARCHIVED_UNTIL = Gauge(
+    "audit_log_archived_until_timestamp_seconds", "Start of the first hour of raw audit logs not yet archived"
+)
+
+# Attachments
+UPLOAD_DURATION = Histogram(
+    "attachment_upload_duration_seconds", "Time to stream an attachment to storage",
+    ["backend", "flow", "outcome"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Times every MongoDB command by the collection it targets
+    """
+
+    # Constructor to initialize the in-flight command map
+    def __init__(self):
+        self.pending: Dict[Tuple, str] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        # The command's first field names its collection, e.g. {"find": "users", ...}, except for getMore,
+        # whose first field is the cursor id: {"getMore": 123, "collection": "users"}
+        field = "collection" if event.command_name == "getMore" else event.command_name
+        target = event.command.get(field)
+        self.pending[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ""
+
+    def finished(self, event, failed: bool):
+        collection = self.pending.pop((event.connection_id, event.request_id), "")
+        MONGO_COMMAND_DURATION.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        if failed:
+            MONGO_COMMAND_FAILURES.labels(collection, event.command_name).inc()
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self.finished(event, failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self.finished(event, failed=True)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording HTTP request latency by method, route template and status
+    """
+
+    # Constructor to initialize the middleware
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The route template keeps label cardinality bounded; unmatched paths share one label
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status)
+            ).observe(time.perf_counter() - started)
+
+def metrics_response() -> Response:
+    """
+    Current metrics in the Prometheus text format
+    """
+
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
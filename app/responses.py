@@ -0,0 +1,39 @@
+import json
+from datetime import date, datetime
+from typing import Any
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def default(value: Any):
+    """
+    Encode the BSON types orjson does not know about
+    """
+
+    if isinstance(value, ObjectId):
+        return str(value)
+    if orjson is None and isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(content: Any) -> bytes:
+    """
+    Serialize documents straight from MongoDB: ObjectId as its hex string, datetime as ISO 8601
+    """
+
+    if orjson is not None:
+        return orjson.dumps(content, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson when available.
+    Endpoints return it directly so raw documents skip jsonable_encoder.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,30 +1,47 @@
 from datetime import datetime, timezone
 from bson import ObjectId
-from fastapi import APIRouter, HTTPException, Request
+from pymongo.errors import DuplicateKeyError
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
 from database import users_collection ,groups_collection
 from app.users.model import UserSignup, UserLogin
-from app.utils import get_password_hash, verify_password, create_access_token, verify_token
+from app.utils import (
+    get_password_hash, verify_password, password_needs_rehash, create_access_token, authenticate_token
+)
 from app.logs.routes import create_log
+from app.cache import get_user_summaries
+from app.responses import FastJSONResponse
+from app.limits import admit_auth, limit_by_ip, limit_user, login_limiter, signup_limiter
 # Router for user endpoints
 user_router = APIRouter()
 
 # ==================== Functions ====================>
 
-def get_current_user_from_token(access_token: str):
+async def get_current_user_from_token(access_token: str):
     """
     Get the current user from the access token
+    Also usable as a dependency for routes taking the token as the access_token query parameter.
+    The auth dependencies are async so FastAPI runs them on the event loop rather than the threadpool.
     """
 
     # Verify the access token
-    payload = verify_token(access_token)
+    payload = await authenticate_token(access_token)
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
 
     return payload
 
-def get_current_user(request: Request):
+async def get_limited_user_from_token(payload: dict = Depends(get_current_user_from_token)):
+    """
+    get_current_user_from_token, charging the request to the user's rate limit
+    """
+
+    limit_user(payload["_id"])
+    return payload
+
+async def get_current_user(request: Request):
     """
     Get the current user from the request
+    Shared dependency for routes authenticated with the Authorization header: Depends(get_current_user)
     """
 
     # Check for the Authorization header
@@ -36,19 +53,32 @@ def get_current_user(request: Request):
     access_token = authorization.split(" ")[1]
 
     # Retrieve the user from the token
-    return get_current_user_from_token(access_token)
+    return await get_current_user_from_token(access_token)
+
+async def get_limited_user(payload: dict = Depends(get_current_user)):
+    """
+    get_current_user, charging the request to the user's rate limit: Depends(get_limited_user)
+    """
+
+    limit_user(payload["_id"])
+    return payload
+
+async def upgrade_password_hash(user_id, password: str):
+    """
+    Re-hash a password with the configured bcrypt cost
+    """
+
+    hashed_password = await get_password_hash(password)
+    await users_collection.update_one({"_id": user_id}, {"$set": {"password": hashed_password}})
 
 # ==================== Endpoints ====================>
 
 @user_router.get("/me")
-async def get_user(request: Request):
+async def get_user(payload: dict = Depends(get_limited_user)):
     """
     Get user details endpoint
     """
 
-    # Get the current user
-    payload = get_current_user(request)
-
     # Get the user from the database
     user = await users_collection.find_one({"_id": ObjectId(payload["_id"])})
     if not user:
@@ -63,31 +93,30 @@ async def get_user(request: Request):
         "is_verified": user["is_verified"]
     }
 
-@user_router.post("/signup")
+@user_router.post("/signup", dependencies=[Depends(limit_by_ip(signup_limiter)), Depends(admit_auth)])
 async def signup(body: UserSignup):
     """
     User signup endpoint
     """
 
-    # Check if the user already exists
-    if await users_collection.find_one({"username": body.username}):
-        raise HTTPException(status_code=400, detail="Username already exists")
-    if await users_collection.find_one({"email": body.email}):
-        raise HTTPException(status_code=400, detail="Email already exists")
-
     # Hashed the password
-    hashed_password = get_password_hash(body.password)
+    hashed_password = await get_password_hash(body.password)
 
-    # Create the user
-    user = await users_collection.insert_one({
-        "role": "user",
-        "username": body.username,
-        "email": body.email,
-        "password": hashed_password,
-        "is_active": True,
-        "is_verified": False,
-        "created_at": datetime.now(timezone.utc)
-    })
+    # Create the user (the unique username/email indexes reject duplicates)
+    try:
+        user = await users_collection.insert_one({
+            "role": "user",
+            "username": body.username,
+            "email": body.email,
+            "password": hashed_password,
+            "is_active": True,
+            "is_verified": False,
+            "created_at": datetime.now(timezone.utc)
+        })
+    except DuplicateKeyError as e:
+        if "email" in (e.details or {}).get("keyPattern", {}):
+            raise HTTPException(status_code=400, detail="Email already exists")
+        raise HTTPException(status_code=400, detail="Username already exists")
 
     # Create the access token
     access_token = create_access_token({
@@ -103,8 +132,8 @@ async def signup(body: UserSignup):
         "access_token": access_token
     }
 
-@user_router.post("/login")
-async def login(body: UserLogin):
+@user_router.post("/login", dependencies=[Depends(limit_by_ip(login_limiter)), Depends(admit_auth)])
+async def login(body: UserLogin, background_tasks: BackgroundTasks):
     """
     User login endpoint
     """
@@ -115,9 +144,13 @@ async def login(body: UserLogin):
         raise HTTPException(status_code=400, detail="Invalid username or password")
 
     # Verify the password
-    if not verify_password(body.password, user["password"]):
+    if not await verify_password(body.password, user["password"]):
         raise HTTPException(status_code=400, detail="Invalid username or password")
 
+    # Upgrade the stored hash after responding if the bcrypt cost changed
+    if password_needs_rehash(user["password"]):
+        background_tasks.add_task(upgrade_password_hash, user["_id"], body.password)
+
     # Create the access token
     access_token = create_access_token({
         "_id": str(user["_id"]),
@@ -135,50 +168,38 @@ async def login(body: UserLogin):
     }
 
 @user_router.get("/user-groups")
-async def get_user_groups(request: Request):
+async def get_user_groups(payload: dict = Depends(get_limited_user)):
     """
     Get groups of the current user
     """
 
-    # Get the current user
-    payload = get_current_user(request)
-
     try:
-        user = await users_collection.find_one({"_id": ObjectId(payload["_id"])})
-        if not user:
+        if payload["_id"] not in await get_user_summaries([payload["_id"]]):
             raise HTTPException(status_code=404, detail="User not found")
 
-        groups_cursor = groups_collection.find({"members": str(user["_id"])})
+        groups_cursor = groups_collection.find(
+            {"members": payload["_id"]}, {"name": 1, "symmetric_key": 1, "members": 1}
+        )
         groups = await groups_cursor.to_list(length=None)
 
-        for group in groups:    
-            group["_id"] = str(group["_id"])
-        
-            # member id and neme/username with group
-        groups_with_members = []
-        
-        for group in groups:
-            members_id_list = group["members"]
-
-            users_cursor = users_collection.find(
-                {"_id": {"$in": [ObjectId(member_id) for member_id in members_id_list]}},
-                {"password": 0,"role":0,"email":0,"is_active":0,"is_verified":0,"created_at":0}
-            )
-            member_details = await users_cursor.to_list(length=None)
-
-            for member in member_details:
-                member["_id"] = str(member["_id"])
-
-            group_info = {
+        # Resolve the members of all groups at once, from the cache where possible
+        members = await get_user_summaries(
+            member_id for group in groups for member_id in group["members"]
+        )
+
+        groups_with_members = [
+            {
                 "_id": group["_id"],
                 "name": group["name"],
                 "symmetric_key": group["symmetric_key"],
-                "members": member_details
+                "members": [members[member_id] for member_id in group["members"] if member_id in members]
             }
-            groups_with_members.append(group_info)
-        
+            for group in groups
+        ]
 
-        return {"groups": groups_with_members}
+        return FastJSONResponse({"groups": groups_with_members})
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
\ No newline at end of file
@@ -1,25 +1,68 @@
 from config import settings
-from typing import Optional
+from typing import Dict, Optional
 from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
 import bcrypt
 import jwt
+from app.cache import TTLCache
+from database import revocations_collection, ensure_ttl_index
+from app.metrics import PASSWORD_POOL_IN_FLIGHT, PASSWORD_POOL_RUN, PASSWORD_POOL_WAIT
 
-def get_password_hash(password: str) -> str:
+class PasswordPool:
     """
-    Hash the password using bcrypt
+    Dedicated, size-limited thread pool for bcrypt work so it never blocks the event loop
     """
 
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
+    # Constructor to initialize the pool
+    def __init__(self, workers: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    # Run a function on the pool, recording how long it queued and ran
+    async def run(self, func, *args):
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            PASSWORD_POOL_WAIT.observe(started - submitted)
+            try:
+                return func(*args)
+            finally:
+                PASSWORD_POOL_RUN.observe(time.perf_counter() - started)
+
+        with PASSWORD_POOL_IN_FLIGHT.track_inprogress():
+            return await asyncio.get_running_loop().run_in_executor(self.executor, job)
+
+# Shared pool for password hashing and verification
+password_pool = PasswordPool(settings.password_hash_workers)
+
+async def get_password_hash(password: str) -> str:
+    """
+    Hash the password using bcrypt (on the password pool)
+    """
+
+    salt = bcrypt.gensalt(rounds=settings.bcrypt_rounds)
+    hashed = await password_pool.run(bcrypt.hashpw, password.encode('utf-8'), salt)
 
     return hashed.decode('utf-8')
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
-    Verify a plain password against a hashed password
+    Verify a plain password against a hashed password (on the password pool)
     """
 
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return await password_pool.run(bcrypt.checkpw, plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """
+    Check if a bcrypt hash was made with a different cost than the configured one
+    """
+
+    try:
+        return int(hashed_password.split("$")[2]) != settings.bcrypt_rounds
+    except (IndexError, ValueError):
+        return True
 
 def create_access_token(data: dict) -> str:
     """
@@ -31,15 +74,169 @@ def create_access_token(data: dict) -> str:
 
     return jwt.encode(payload, settings.secret_key, algorithm="HS256")
 
-def verify_token(token: str) -> Optional[dict]:
+def create_upload_slot_token(data: dict) -> str:
+    """
+    Create a short-lived JWT describing an upload slot
+    """
+
+    payload = data.copy()
+    payload.update({
+        "purpose": "upload_slot",
+        "exp": datetime.now(timezone.utc) + timedelta(seconds=settings.upload_slot_expire_seconds)
+    })
+
+    return jwt.encode(payload, settings.secret_key, algorithm="HS256")
+
+def verify_upload_slot_token(token: str) -> Optional[dict]:
     """
-    Verify a JWT token and return the payload if valid, else None
+    Verify an upload slot JWT and return its payload if valid, else None
+    """
+
+    try:
+        payload = jwt.decode(token, settings.secret_key, algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        return None
+
+    if payload.get("purpose") != "upload_slot":
+        return None
+    return payload
+
+# Verified token payloads, each kept until its own exp
+token_cache = TTLCache("token", maxsize=settings.token_cache_size, ttl=60 * int(settings.access_token_expire_minutes))
+
+# User ids whose tokens must stop working (deleted users) -> when the entry can be forgotten
+revoked_users: Dict[str, float] = {}
+
+def token_lifetime() -> int:
+    """
+    Seconds an access token stays valid, and so how long a revocation has to be kept
+    """
+
+    return 60 * int(settings.access_token_expire_minutes)
+
+def revoke_user_tokens(user_id: str, revoked_at: Optional[float] = None):
+    """
+    Reject every token of a user from now on, cached or not, on this node; manager.invalidate reaches every node
+    """
+
+    revoked_users[user_id] = (revoked_at or time.time()) + token_lifetime()
+    token_cache.invalidate_where(lambda payload: payload.get("_id") == user_id)
+
+async def store_revocation(user_id: str):
+    """
+    Persist a revocation, so nodes that start later or miss the broadcast still reject the user's tokens.
+    Stored revocations expire with the token lifetime (see load_revocations).
+    """
+
+    await revocations_collection.update_one(
+        {"_id": user_id}, {"$set": {"revoked_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+
+def revoked_timestamp(document: dict) -> float:
+    """
+    When a stored revocation was made; pymongo returns naive UTC datetimes
+    """
+
+    return document["revoked_at"].replace(tzinfo=timezone.utc).timestamp()
+
+async def load_revocations() -> int:
+    """
+    Expire stored revocations after the token lifetime and load the live ones into the revocation set; run at startup
+    """
+
+    await ensure_ttl_index(revocations_collection, "revoked_at_ttl", "revoked_at", token_lifetime())
+
+    since = datetime.now(timezone.utc) - timedelta(seconds=token_lifetime())
+    loaded = 0
+    async for document in revocations_collection.find({"revoked_at": {"$gt": since}}):
+        revoke_user_tokens(document["_id"], revoked_timestamp(document))
+        loaded += 1
+    return loaded
+
+async def check_stored_revocation(user_id: Optional[str]) -> bool:
+    """
+    Look a user up in the stored revocations, adding a live one to the revocation set
+    """
+
+    if user_id is None:
+        return False
+    document = await revocations_collection.find_one({"_id": user_id})
+    if document is None or revoked_timestamp(document) + token_lifetime() <= time.time():
+        return False
+    revoke_user_tokens(user_id, revoked_timestamp(document))
+    return True
+
+def is_revoked(user_id: Optional[str]) -> bool:
+    """
+    Check the revocation set, forgetting entries older than any token they could match
+    """
+
+    revoked_until = revoked_users.get(user_id)
+    if revoked_until is None:
+        return False
+    if revoked_until <= time.time():
+        del revoked_users[user_id]
+        return False
+    return True
+
+def decode_access_token(token: str) -> Optional[dict]:
+    """
+    Decode a JWT and return its payload if it is a valid access token, else None
     """
 
     try:
         payload = jwt.decode(token, settings.secret_key, algorithms=["HS256"])
-        return payload
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
+
+    # Only access tokens authenticate requests
+    if "purpose" in payload:
+        return None
+    return payload
+
+def cache_token(token: str, payload: dict):
+    """
+    Keep a verified payload until its token expires
+    """
+
+    ttl = payload.get("exp", 0) - time.time()
+    if ttl > 0:
+        token_cache.set(token, payload, ttl=ttl)
+
+def verify_token(token: str) -> Optional[dict]:
+    """
+    Verify a JWT token and return the payload if valid, else None.
+    Verified payloads are cached until the token expires.
+    Only the in-memory revocation set is checked; request authentication goes through authenticate_token.
+    """
+
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = decode_access_token(token)
+        if payload is None:
+            return None
+        cache_token(token, payload)
+
+    if is_revoked(payload.get("_id")):
+        return None
+
+    return payload
+
+async def authenticate_token(token: str) -> Optional[dict]:
+    """
+    verify_token that also checks the stored revocations when the token is not cached yet
+    """
+
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = decode_access_token(token)
+        if payload is None or await check_stored_revocation(payload.get("_id")):
+            return None
+        cache_token(token, payload)
+
+    if is_revoked(payload.get("_id")):
+        return None
+
+    return payload
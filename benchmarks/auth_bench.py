@@ -0,0 +1,129 @@
+"""
+Per-request cost of token verification.
+
+Function level: full jwt.decode against verify_token with the payload cached.
+Dependency level: a request through a FastAPI route authenticated with
+  - before: a sync dependency calling jwt.decode (run on the threadpool)
+  - sync_cached: a sync dependency calling verify_token (cached, but still a threadpool hop)
+  - after: Depends(get_current_user), async and cached, run on the event loop
+plus an unauthenticated route as the floor. Requests are driven straight through the ASGI app.
+
+Run from the repository root:
+    python -m benchmarks.auth_bench [iterations] [requests]
+"""
+
+import sys
+import json
+import time
+import asyncio
+
+from benchmarks import fake_mongo
+fake_mongo.configure_environment()
+
+import jwt
+from fastapi import Depends, FastAPI, HTTPException, Request
+from config import settings
+from app.utils import create_access_token, verify_token, token_cache
+from app.users.controller import get_current_user
+
+def measure(func, iterations: int) -> float:
+    """
+    Mean microseconds per call
+    """
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+def bearer(request: Request) -> str:
+    authorization = request.headers.get("Authorization", "")
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401)
+    return authorization.split(" ")[1]
+
+def decode_sync(request: Request):
+    return jwt.decode(bearer(request), settings.secret_key, algorithms=["HS256"])
+
+def verify_sync(request: Request):
+    return verify_token(bearer(request))
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/none")
+    async def unauthenticated():
+        return None
+
+    @app.get("/before")
+    async def before(payload: dict = Depends(decode_sync)):
+        return None
+
+    @app.get("/sync_cached")
+    async def sync_cached(payload: dict = Depends(verify_sync)):
+        return None
+
+    @app.get("/after")
+    async def after(payload: dict = Depends(get_current_user)):
+        return None
+
+    return app
+
+async def measure_route(app: FastAPI, path: str, token: str, requests: int) -> float:
+    """
+    Mean microseconds per request through the ASGI app
+    """
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"authorization", f"Bearer {token}".encode())],
+        "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    status = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    elapsed = time.perf_counter() - started
+    assert set(status) == {200}, set(status)
+    return elapsed / requests * 1e6
+
+async def measure_routes(token: str, requests: int) -> dict:
+    app = build_app()
+    results = {}
+    for path in ("/none", "/before", "/sync_cached", "/after"):
+        await measure_route(app, path, token, min(requests, 500))
+        results[path.strip("/") + "_us"] = round(await measure_route(app, path, token, requests), 1)
+    return results
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    token = create_access_token({"_id": "0" * 24, "role": "user", "username": "bench", "email": "bench@example.com"})
+
+    uncached = measure(lambda: jwt.decode(token, settings.secret_key, algorithms=["HS256"]), iterations)
+
+    token_cache.clear()
+    verify_token(token)
+    cached = measure(lambda: verify_token(token), iterations)
+
+    print(json.dumps({
+        "benchmark": "auth",
+        "iterations": iterations,
+        "jwt_decode_us": round(uncached, 3),
+        "verify_token_cached_us": round(cached, 3),
+        "speedup": round(uncached / cached, 1),
+        "requests": requests,
+        "dependency": asyncio.run(measure_routes(token, requests)),
+    }))
+
+if __name__ == "__main__":
+    main()
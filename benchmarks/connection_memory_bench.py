@@ -0,0 +1,71 @@
+"""
+Memory held per idle WebSocket connection in the ConnectionManager registry: the Connection,
+its outbound queue, writer task and delivery state for a few groups.
+
+Sockets are in-process stand-ins, so the numbers cover the app's per-connection state only,
+not the server's protocol buffers.
+
+Run from the repository root:
+    python -m benchmarks.connection_memory_bench [connections] [groups_per_user] [devices_per_user]
+"""
+
+import sys
+import gc
+import json
+import asyncio
+import tracemalloc
+
+from benchmarks import fake_mongo
+fake_mongo.configure_environment()
+
+from bson import ObjectId
+import app.messages.controller as controller
+from app.messages.broker import InMemoryBroker
+
+class Socket:
+    async def send_text(self, payload):
+        pass
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    groups_per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    devices = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+
+    manager = controller.ConnectionManager(InMemoryBroker())
+    group_ids = [str(ObjectId()) for _ in range(groups_per_user)]
+    user_ids = [str(ObjectId()) for _ in range(count // devices)]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+
+    for index in range(count):
+        connection = controller.Connection(user_ids[index % len(user_ids)], Socket())
+        connection.watermarks = {group_id: 0 for group_id in group_ids}
+        connection.flushed = dict(connection.watermarks)
+        connection.writer_task = asyncio.create_task(manager.write_loop(connection))
+        manager.active_users.setdefault(connection.user_id, set()).add(connection)
+
+    # Let every writer reach its idle wait on the queue
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    connections = list(manager.connections())
+    for connection in connections:
+        connection.writer_task.cancel()
+
+    print(json.dumps({
+        "benchmark": "connection_memory",
+        "connections": len(connections),
+        "users": len(manager.active_users),
+        "groups_per_user": groups_per_user,
+        "total_mib": round(allocated / 2**20, 2),
+        "bytes_per_connection": round(allocated / len(connections)),
+    }))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,588 @@
+"""
+In-process stand-in for pymongo's AsyncMongoClient, covering the queries and updates the app issues.
+
+install() must run before the database module is imported:
+
+    from benchmarks import fake_mongo
+    fake_mongo.install(latency=0.0005)
+    import main
+
+Every operation yields to the event loop and can sleep for a simulated round trip.
+Unique indexes are enforced so signup and message numbering behave as they do against MongoDB.
+"""
+
+import os
+import asyncio
+import re
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+import pymongo
+from pymongo import ReturnDocument
+from pymongo.errors import CollectionInvalid, DuplicateKeyError
+
+MISSING = object()
+
+def get_path(document: dict, path: str) -> Any:
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+def copy_document(document: dict) -> dict:
+    # Lists and nested documents are copied one level deep, like a fresh BSON decode would
+    return {
+        key: list(value) if isinstance(value, list) else dict(value) if isinstance(value, dict) else value
+        for key, value in document.items()
+    }
+
+def compare(value: Any, operator: str, operand: Any) -> bool:
+    try:
+        if operator == "$gt":
+            return value > operand
+        if operator == "$gte":
+            return value >= operand
+        if operator == "$lt":
+            return value < operand
+        if operator == "$lte":
+            return value <= operand
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported operator {operator}")
+
+def match_value(value: Any, condition: Any) -> bool:
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        for operator, operand in condition.items():
+            if operator == "$exists":
+                if (value is not MISSING) != bool(operand):
+                    return False
+            elif operator == "$eq":
+                if not match_value(value, operand):
+                    return False
+            elif operator == "$ne":
+                if match_value(value, operand):
+                    return False
+            elif operator == "$in":
+                if not any(match_value(value, candidate) for candidate in operand):
+                    return False
+            elif operator == "$nin":
+                if any(match_value(value, candidate) for candidate in operand):
+                    return False
+            elif operator == "$regex":
+                if not isinstance(value, str) or not re.search(operand, value):
+                    return False
+            else:
+                if value is MISSING:
+                    return False
+                values = value if isinstance(value, list) else [value]
+                if not any(compare(item, operator, operand) for item in values):
+                    return False
+        return True
+
+    if value is MISSING:
+        return condition is None
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value == condition
+
+def matches(document: dict, query: Optional[dict]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(document, clause) for clause in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, clause) for clause in condition):
+                return False
+        elif not match_value(get_path(document, key), condition):
+            return False
+    return True
+
+def project(document: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return copy_document(document)
+
+    include = {key for key, flag in projection.items() if flag}
+    if include:
+        projected = {key: document[key] for key in include if key in document and key != "_id"}
+        if projection.get("_id", 1) and "_id" in document:
+            projected["_id"] = document["_id"]
+        return copy_document(projected)
+
+    exclude = {key for key, flag in projection.items() if not flag}
+    return copy_document({key: value for key, value in document.items() if key not in exclude})
+
+def sort_key(value: Any) -> tuple:
+    # Missing and None sort first, then by type, like BSON comparison order
+    if value is MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (4, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, ObjectId):
+        return (3, value.binary)
+    return (5, value)
+
+def apply_update(document: dict, update: dict, inserting: bool = False):
+    for operator, fields in update.items():
+        for key, operand in fields.items():
+            current = document.get(key, MISSING)
+            if operator == "$set":
+                document[key] = operand
+            elif operator == "$setOnInsert":
+                if inserting:
+                    document[key] = operand
+            elif operator == "$unset":
+                document.pop(key, None)
+            elif operator == "$inc":
+                document[key] = (0 if current is MISSING else current) + operand
+            elif operator == "$max":
+                if current is MISSING or operand > current:
+                    document[key] = operand
+            elif operator == "$min":
+                if current is MISSING or operand < current:
+                    document[key] = operand
+            elif operator in ("$push", "$addToSet"):
+                items = operand["$each"] if isinstance(operand, dict) and "$each" in operand else [operand]
+                array = document.setdefault(key, [])
+                for item in items:
+                    if operator == "$push" or item not in array:
+                        array.append(item)
+            elif operator == "$pull":
+                if isinstance(current, list):
+                    document[key] = [item for item in current if not match_value(item, operand)]
+            else:
+                raise ValueError(f"Unsupported update operator {operator}")
+
+class FakeCursor:
+    """
+    The subset of AsyncCursor the app uses
+    """
+
+    def __init__(self, collection: "FakeCollection", query: Optional[dict], projection: Optional[dict]):
+        self.collection = collection
+        self.query = query or {}
+        self.projection = projection
+        self.sort_spec: List[Tuple[str, int]] = []
+        self.limit_count = 0
+        self.skip_count = 0
+
+    def sort(self, key, direction=None):
+        self.sort_spec = list(key) if isinstance(key, list) else [(key, direction or 1)]
+        return self
+
+    def limit(self, count: int):
+        self.limit_count = count
+        return self
+
+    def skip(self, count: int):
+        self.skip_count = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def results(self) -> List[dict]:
+        documents = self.collection.scan(self.query)
+        for key, direction in reversed(self.sort_spec):
+            documents.sort(key=lambda document: sort_key(get_path(document, key)), reverse=direction < 0)
+        documents = documents[self.skip_count:]
+        if self.limit_count:
+            documents = documents[:self.limit_count]
+        return [project(document, self.projection) for document in documents]
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        await self.collection.round_trip()
+        documents = self.results()
+        return documents[:length] if length else documents
+
+    def __aiter__(self):
+        async def iterate():
+            await self.collection.round_trip()
+            for document in self.results():
+                yield document
+        return iterate()
+
+    async def close(self):
+        pass
+
+    async def explain(self) -> dict:
+        return {"queryPlanner": {"winningPlan": {"stage": "FAKE"}}, "executionStats": {"executionTimeMillis": 0}}
+
+def group_key(document: dict, expression: Any) -> Any:
+    # A "$field" path, a document of them, or a constant
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = get_path(document, expression[1:])
+        return None if value is MISSING else value
+    if isinstance(expression, dict):
+        return {key: group_key(document, value) for key, value in expression.items()}
+    return expression
+
+def run_pipeline(documents: List[dict], pipeline: List[dict]) -> List[dict]:
+    # $match, $group (with $sum, $min, $max), $sort and $limit
+    for stage in pipeline:
+        (operator, spec), = stage.items()
+        if operator == "$match":
+            documents = [document for document in documents if matches(document, spec)]
+        elif operator == "$group":
+            groups: Dict[str, dict] = {}
+            for document in documents:
+                key = group_key(document, spec["_id"])
+                group = groups.setdefault(repr(key), {"_id": key})
+                for field, accumulator in spec.items():
+                    if field == "_id":
+                        continue
+                    (kind, expression), = accumulator.items()
+                    value = group_key(document, expression)
+                    if kind == "$sum":
+                        group[field] = group.get(field, 0) + (value if isinstance(value, (int, float)) else 0)
+                    elif kind in ("$min", "$max"):
+                        current = group.get(field)
+                        if current is None or (value < current if kind == "$min" else value > current):
+                            group[field] = value
+                    else:
+                        raise ValueError(f"Unsupported accumulator {kind}")
+            documents = list(groups.values())
+        elif operator == "$sort":
+            for key, direction in reversed(list(spec.items())):
+                documents.sort(key=lambda document: sort_key(get_path(document, key)), reverse=direction < 0)
+        elif operator == "$limit":
+            documents = documents[:spec]
+        else:
+            raise ValueError(f"Unsupported pipeline stage {operator}")
+    return documents
+
+class FakeCommandCursor:
+    """
+    The subset of AsyncCommandCursor the app uses, over precomputed results
+    """
+
+    def __init__(self, documents: List[dict]):
+        self.documents = documents
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        return self.documents[:length] if length else self.documents
+
+    def __aiter__(self):
+        async def iterate():
+            for document in self.documents:
+                yield document
+        return iterate()
+
+    async def close(self):
+        pass
+
+class FakeCollection:
+    """
+    Documents kept in insertion order, keyed by _id
+    """
+
+    def __init__(self, database: "FakeDatabase", name: str):
+        self.database = database
+        self.name = name
+        self.documents: Dict[Any, dict] = {}
+        self.indexes: Dict[str, dict] = {"_id_": {"key": [("_id", 1)], "unique": True}}
+        self.unique_keys: Dict[str, set] = {}
+
+    async def round_trip(self):
+        await asyncio.sleep(self.database.client.latency)
+
+    def scan(self, query: dict) -> List[dict]:
+        # Direct lookup for _id equality, full scan otherwise
+        if "_id" in query and not isinstance(query["_id"], dict):
+            document = self.documents.get(query["_id"])
+            return [document] if document is not None and matches(document, query) else []
+        return [document for document in self.documents.values() if matches(document, query)]
+
+    # Unique index bookkeeping
+    def index_entries(self, document: dict):
+        for name, index in self.indexes.items():
+            if name == "_id_" or not index.get("unique"):
+                continue
+            partial = index.get("partialFilterExpression")
+            if partial and not matches(document, partial):
+                continue
+            yield name, tuple(repr(get_path(document, field)) for field, _ in index["key"])
+
+    def index_add(self, document: dict):
+        entries = list(self.index_entries(document))
+        for name, entry in entries:
+            if entry in self.unique_keys.setdefault(name, set()):
+                pattern = {field: direction for field, direction in self.indexes[name]["key"]}
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.name} index: {name}",
+                    11000, {"keyPattern": pattern}
+                )
+        for name, entry in entries:
+            self.unique_keys[name].add(entry)
+
+    def index_remove(self, document: dict):
+        for name, entry in self.index_entries(document):
+            self.unique_keys.get(name, set()).discard(entry)
+
+    def store(self, document: dict) -> Any:
+        document.setdefault("_id", ObjectId())
+        if document["_id"] in self.documents:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_", 11000, {"keyPattern": {"_id": 1}})
+        self.index_add(document)
+        # Keep a copy, like the server does; the caller's dict only gains its _id
+        self.documents[document["_id"]] = copy_document(document)
+        return document["_id"]
+
+    def replace(self, old: dict, new: dict):
+        self.index_remove(old)
+        try:
+            self.index_add(new)
+        except DuplicateKeyError:
+            self.index_add(old)
+            raise
+        self.documents[new["_id"]] = new
+
+    def update(self, query: dict, update: dict, upsert: bool, many: bool) -> SimpleNamespace:
+        targets = self.scan(query)
+        if not many:
+            targets = targets[:1]
+
+        modified = 0
+        for document in targets:
+            updated = copy_document(document)
+            apply_update(updated, update)
+            if updated != document:
+                self.replace(document, updated)
+                modified += 1
+
+        upserted_id = None
+        if not targets and upsert:
+            document = {key: value for key, value in query.items() if not key.startswith("$") and not isinstance(value, dict)}
+            apply_update(document, update, inserting=True)
+            upserted_id = self.store(document)
+
+        return SimpleNamespace(matched_count=len(targets), modified_count=modified, upserted_id=upserted_id, acknowledged=True)
+
+    def remove(self, query: dict, many: bool) -> SimpleNamespace:
+        targets = self.scan(query)
+        if not many:
+            targets = targets[:1]
+        for document in targets:
+            self.index_remove(document)
+            del self.documents[document["_id"]]
+        return SimpleNamespace(deleted_count=len(targets), acknowledged=True)
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None, **kwargs) -> FakeCursor:
+        return FakeCursor(self, query, projection)
+
+    async def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None, sort=None, **kwargs) -> Optional[dict]:
+        await self.round_trip()
+        cursor = FakeCursor(self, query, projection).limit(1)
+        if sort:
+            cursor.sort(sort)
+        documents = cursor.results()
+        return documents[0] if documents else None
+
+    async def insert_one(self, document: dict, **kwargs) -> SimpleNamespace:
+        await self.round_trip()
+        return SimpleNamespace(inserted_id=self.store(document), acknowledged=True)
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True, **kwargs) -> SimpleNamespace:
+        await self.round_trip()
+        return SimpleNamespace(inserted_ids=[self.store(document) for document in documents], acknowledged=True)
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False, **kwargs) -> SimpleNamespace:
+        await self.round_trip()
+        return self.update(query, update, upsert, many=False)
+
+    async def update_many(self, query: dict, update: dict, upsert: bool = False, **kwargs) -> SimpleNamespace:
+        await self.round_trip()
+        return self.update(query, update, upsert, many=True)
+
+    async def find_one_and_update(self, query: dict, update: dict, projection: Optional[dict] = None,
+                                  upsert: bool = False, return_document: bool = ReturnDocument.BEFORE, **kwargs):
+        await self.round_trip()
+        targets = self.scan(query)[:1]
+        before = targets[0] if targets else None
+        self.update(query, update, upsert, many=False)
+        if return_document == ReturnDocument.AFTER:
+            documents = FakeCursor(self, query, projection).limit(1).results()
+            return documents[0] if documents else None
+        return project(before, projection) if before else None
+
+    async def replace_one(self, query: dict, replacement: dict, upsert: bool = False, **kwargs) -> SimpleNamespace:
+        await self.round_trip()
+        targets = self.scan(query)[:1]
+        if targets:
+            self.replace(targets[0], {**copy_document(replacement), "_id": targets[0]["_id"]})
+            return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None, acknowledged=True)
+        upserted_id = None
+        if upsert:
+            document = {key: value for key, value in query.items() if not key.startswith("$") and not isinstance(value, dict)}
+            upserted_id = self.store({**document, **replacement})
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=upserted_id, acknowledged=True)
+
+    async def delete_one(self, query: dict, **kwargs) -> SimpleNamespace:
+        await self.round_trip()
+        return self.remove(query, many=False)
+
+    async def delete_many(self, query: dict, **kwargs) -> SimpleNamespace:
+        await self.round_trip()
+        return self.remove(query, many=True)
+
+    async def bulk_write(self, requests: list, ordered: bool = True, **kwargs) -> SimpleNamespace:
+        await self.round_trip()
+        counts = {"inserted_count": 0, "matched_count": 0, "modified_count": 0, "deleted_count": 0, "upserted_count": 0}
+        for request in requests:
+            if isinstance(request, pymongo.InsertOne):
+                self.store(request._doc)
+                counts["inserted_count"] += 1
+            elif isinstance(request, (pymongo.UpdateOne, pymongo.UpdateMany)):
+                result = self.update(request._filter, request._doc, bool(request._upsert), isinstance(request, pymongo.UpdateMany))
+                counts["matched_count"] += result.matched_count
+                counts["modified_count"] += result.modified_count
+                counts["upserted_count"] += result.upserted_id is not None
+            elif isinstance(request, (pymongo.DeleteOne, pymongo.DeleteMany)):
+                counts["deleted_count"] += self.remove(request._filter, isinstance(request, pymongo.DeleteMany)).deleted_count
+            else:
+                raise ValueError(f"Unsupported bulk operation {type(request).__name__}")
+        return SimpleNamespace(acknowledged=True, **counts)
+
+    async def aggregate(self, pipeline: List[dict], **kwargs) -> FakeCommandCursor:
+        await self.round_trip()
+        # A leading $match filters before anything is copied, as it would use an index on the server
+        query = pipeline[0]["$match"] if pipeline and "$match" in pipeline[0] else {}
+        documents = [copy_document(document) for document in self.scan(query)]
+        return FakeCommandCursor(run_pipeline(documents, pipeline[1:] if query else pipeline))
+
+    async def count_documents(self, query: dict, **kwargs) -> int:
+        await self.round_trip()
+        return len(self.scan(query))
+
+    async def distinct(self, key: str, query: Optional[dict] = None, **kwargs) -> list:
+        await self.round_trip()
+        values = []
+        for document in self.scan(query or {}):
+            value = get_path(document, key)
+            for item in (value if isinstance(value, list) else [value]):
+                if item is not MISSING and item not in values:
+                    values.append(item)
+        return values
+
+    async def create_indexes(self, indexes: list, **kwargs) -> List[str]:
+        await self.round_trip()
+        names = []
+        for model in indexes:
+            document = dict(model.document)
+            name = document.pop("name")
+            document["key"] = list(document["key"].items())
+            self.indexes[name] = document
+            self.unique_keys.pop(name, None)
+            for stored in self.documents.values():
+                for entry_name, entry in self.index_entries(stored):
+                    if entry_name == name:
+                        self.unique_keys.setdefault(name, set()).add(entry)
+            names.append(name)
+        return names
+
+    async def create_index(self, keys, **kwargs) -> str:
+        return (await self.create_indexes([pymongo.IndexModel(keys, **kwargs)]))[0]
+
+    async def drop_index(self, name: str, **kwargs):
+        await self.round_trip()
+        self.indexes.pop(name, None)
+        self.unique_keys.pop(name, None)
+
+    async def index_information(self) -> dict:
+        await self.round_trip()
+        return {name: dict(index) for name, index in self.indexes.items()}
+
+    async def drop(self):
+        self.database.collections.pop(self.name, None)
+
+class FakeDatabase:
+    """
+    Collections created on first access
+    """
+
+    def __init__(self, client: "FakeMongoClient", name: str):
+        self.client = client
+        self.name = name
+        self.collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(self, name)
+        return self.collections[name]
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def create_collection(self, name: str, **kwargs) -> FakeCollection:
+        if name in self.collections:
+            raise CollectionInvalid(f"collection {name} already exists")
+        return self[name]
+
+    async def list_collection_names(self) -> List[str]:
+        return list(self.collections)
+
+    async def command(self, command, *args, **kwargs) -> dict:
+        # collMod only changes a TTL index's expiry here; documents never expire in the stand-in
+        if command == "collMod" and "index" in kwargs:
+            index = self[args[0]].indexes.get(kwargs["index"]["name"])
+            if index is not None:
+                index["expireAfterSeconds"] = kwargs["index"]["expireAfterSeconds"]
+        return {"ok": 1.0}
+
+class FakeMongoClient:
+    """
+    Drop-in for AsyncMongoClient; every client shares the same databases
+    """
+
+    databases: Dict[str, FakeDatabase] = {}
+    latency = 0.0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getitem__(self, name: str) -> FakeDatabase:
+        if name not in self.databases:
+            self.databases[name] = FakeDatabase(self, name)
+        return self.databases[name]
+
+    def __getattr__(self, name: str) -> FakeDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def aconnect(self):
+        pass
+
+    async def close(self):
+        pass
+
+# Settings the app requires at import time; benchmarks never talk to external services
+BENCHMARK_ENV = {
+    "ENVIRONMENT": "benchmark", "DATABASE_URL": "mongodb://localhost:27017", "SECRET_KEY": "benchmark-secret",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "60", "ALLOWED_ORIGINS": '["*"]', "AWS_ACCESS_KEY": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark", "AWS_REGION": "us-east-1", "S3_BUCKET_NAME": "benchmark",
+    "STORAGE_BACKEND": "memory", "BROKER_BACKEND": "memory",
+}
+
+def configure_environment(**overrides: str):
+    """
+    Fill in any settings missing from the environment; must run before config is imported
+    """
+
+    for key, value in {**BENCHMARK_ENV, **overrides}.items():
+        os.environ.setdefault(key, value)
+
+def install(latency: float = 0.0):
+    """
+    Make pymongo.AsyncMongoClient the in-process fake, with an optional simulated round trip in seconds
+    """
+
+    FakeMongoClient.latency = latency
+    pymongo.AsyncMongoClient = FakeMongoClient
@@ -0,0 +1,56 @@
+"""
+CPU cost of serializing one group message for every member, before (send_json per recipient)
+and after (one shared Frame encoded once per wire format).
+
+Run from the repository root:
+    python -m benchmarks.fanout_bench [messages]
+"""
+
+import sys
+import json
+import time
+
+from benchmarks import fake_mongo
+fake_mongo.configure_environment()
+
+from app.messages.codec import JSON, Frame
+
+FRAME = {
+    "group_id": "0" * 24,
+    "seq": 1,
+    "group_name": "benchmark",
+    "sender_id": "1" * 24,
+    "sender_username": "benchmark",
+    "message": "x" * 200,
+    "created_at": "2025-01-01T00:00:00+00:00",
+}
+
+def per_recipient(members: int):
+    for _ in range(members):
+        json.dumps(dict(FRAME), separators=(",", ":"), ensure_ascii=False)
+
+def shared(members: int):
+    frame = Frame(dict(FRAME))
+    for _ in range(members):
+        frame.encode(JSON)
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    results = []
+    for members in (10, 100, 1000):
+        timings = {}
+        for name, func in (("per_recipient", per_recipient), ("shared", shared)):
+            started = time.perf_counter()
+            for _ in range(messages):
+                func(members)
+            timings[name] = (time.perf_counter() - started) / messages * 1e6
+        results.append({
+            "members": members,
+            "per_recipient_us": round(timings["per_recipient"], 1),
+            "shared_us": round(timings["shared"], 1),
+            "speedup": round(timings["per_recipient"] / timings["shared"], 1),
+        })
+    print(json.dumps({"benchmark": "fanout_encode", "messages": messages, "results": results}))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Serialization cost of the HQ list endpoints at 10k and 100k documents, before (str(_id) loop,
+jsonable_encoder and the stock JSONResponse) and after (documents handed to FastJSONResponse as is).
+
+The endpoints are called directly with an in-process users collection, so only the Python side
+of the request is measured.
+
+Run from the repository root:
+    python -m benchmarks.hq_list_bench [sizes...]
+"""
+
+import sys
+import json
+import time
+import asyncio
+from datetime import datetime, timedelta
+
+from benchmarks import fake_mongo
+fake_mongo.configure_environment()
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+import app.hq.routes as hq
+
+def make_users(count: int) -> list:
+    created_at = datetime(2025, 1, 1)
+    return [
+        {
+            "_id": ObjectId(),
+            "username": f"user{index}",
+            "email": f"user{index}@example.com",
+            "role": "user",
+            "is_verified": index % 3 != 0,
+            "created_at": created_at + timedelta(seconds=index),
+        }
+        for index in range(count)
+    ]
+
+class Cursor:
+    def __init__(self, documents: list):
+        self.documents = documents
+
+    async def to_list(self, length=None):
+        # A driver cursor hands out fresh documents on every call
+        return [dict(document) for document in self.documents]
+
+class Users:
+    def __init__(self, documents: list):
+        self.documents = documents
+
+    def find(self, query, projection=None):
+        return Cursor(self.documents)
+
+async def before(users: Users) -> bytes:
+    documents = await users.find({}, {"password": 0}).to_list(length=None)
+    for document in documents:
+        document["_id"] = str(document["_id"])
+    return JSONResponse(jsonable_encoder({"users": documents})).body
+
+async def after(users: Users) -> bytes:
+    hq.users_collection = users
+    return (await hq.get_all_users()).body
+
+async def measure(func, users: Users, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await func(users)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+async def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [10000, 100000]
+    results = []
+    for size in sizes:
+        users = Users(make_users(size))
+        assert json.loads(await before(users)) == json.loads(await after(users))
+
+        repeat = 5 if size <= 10000 else 2
+        before_ms = await measure(before, users, repeat)
+        after_ms = await measure(after, users, repeat)
+        results.append({
+            "documents": size,
+            "before_ms": round(before_ms, 1),
+            "after_ms": round(after_ms, 1),
+            "speedup": round(before_ms / after_ms, 1),
+        })
+    print(json.dumps({"benchmark": "hq_list", "endpoint": "/api/hq/all-users", "results": results}))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""
+Cold-start cost of the app: wall time to import main in a fresh interpreter, with the S3 storage
+backend selected. "lazy" is the import as it runs now; "eager" also builds the S3 client right after,
+which is what importing main used to do (boto3 was imported and the client created at module load).
+
+Also prints the slowest modules of one lazy run from python -X importtime.
+
+Run from the repository root:
+    python -m benchmarks.import_time_bench [runs] [top_modules]
+"""
+
+import os
+import sys
+import json
+import statistics
+import subprocess
+from benchmarks.fake_mongo import BENCHMARK_ENV
+
+# main is imported with the S3 backend, so the cost of the storage client shows up
+ENV = {**BENCHMARK_ENV, "STORAGE_BACKEND": "s3"}
+
+SCRIPTS = {
+    "lazy": "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)",
+    "eager": (
+        "import time; t = time.perf_counter(); import main; main.storage.create_client(); "
+        "print(time.perf_counter() - t)"
+    ),
+}
+
+def run(code: str, *flags: str) -> subprocess.CompletedProcess:
+    env = {**os.environ, **ENV}
+    return subprocess.run([sys.executable, *flags, "-c", code], env=env, capture_output=True, text=True, check=True)
+
+def import_profile(top: int) -> list:
+    """
+    Slowest modules by cumulative import time, in milliseconds
+    """
+
+    rows = []
+    for line in run("import main", "-X", "importtime").stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative) / 1000, name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": round(ms, 1)} for ms, name in rows[:top]]
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 15
+
+    results = {}
+    for mode, code in SCRIPTS.items():
+        timings = [float(run(code).stdout.strip()) * 1000 for _ in range(runs)]
+        results[mode] = {"median_ms": round(statistics.median(timings), 1), "min_ms": round(min(timings), 1)}
+
+    loaded = run("import sys, main; print('boto3' in sys.modules)").stdout.strip() == "True"
+    print(json.dumps({
+        "benchmark": "import_time",
+        "runs": runs,
+        "results": results,
+        "saved_ms": round(results["eager"]["median_ms"] - results["lazy"]["median_ms"], 1),
+        "boto3_imported_by_main": loaded,
+        "slowest_modules": import_profile(top),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
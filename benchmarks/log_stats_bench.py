@@ -0,0 +1,109 @@
+"""
+"Logins per hour this week" at 10k and 100k raw audit logs. Before: the dashboard pulled every log entry
+through /api/logs/all-logs and counted client-side. After: /api/logs/stats reads the rollups.
+
+Logs and their rollups are seeded into the in-process MongoDB stand-in; the rollups are the documents
+create_log's $inc upserts would have produced. Rollup count is bounded by buckets x actions x users,
+and the query reads at most one document per hour of the week however many raw logs exist.
+The stand-in scans without indexes, so after_ms still grows with the rollup collection here.
+
+Run from the repository root:
+    python -m benchmarks.log_stats_bench [sizes...]
+"""
+
+import sys
+import json
+import time
+import random
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from benchmarks import fake_mongo
+fake_mongo.configure_environment()
+
+fake_mongo.install()
+
+import app.logs.routes as logs
+from database import logs_collection, log_rollups_collection
+
+ACTIONS = ["LOGIN"] * 8 + ["SIGNUP", "CREATE_GROUP", "ADD_MEMBERS_TO_GROUP", "DELETE_USER"]
+
+async def seed(count: int, users: int, now: datetime):
+    logs_collection.documents.clear()
+    log_rollups_collection.documents.clear()
+
+    random.seed(count)
+    entries = [
+        {
+            "username": f"user{random.randrange(users)}",
+            "action": random.choice(ACTIONS),
+            "target": None,
+            "timestamp": now - timedelta(seconds=random.randrange(7 * 24 * 3600)),
+        }
+        for _ in range(count)
+    ]
+    await logs_collection.insert_many(entries)
+    await log_rollups_collection.insert_many([
+        {"granularity": granularity, "bucket": bucket, "action": action, "username": username, "count": total}
+        for (granularity, bucket, action, username), total in logs.rollup_counts(entries).items()
+    ])
+
+async def before(now: datetime) -> dict:
+    # Every page of the week's logs, then a client-side count per hour
+    entries, cursor = [], None
+    while True:
+        page = json.loads((await logs.get_all_logs(
+            limit=1000, cursor=cursor, username=None, action="LOGIN", target=None,
+            since=now - timedelta(days=7), until=now, format="json"
+        )).body)
+        entries += page["logs"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    return Counter(entry["timestamp"][:13] for entry in entries)
+
+async def after(now: datetime) -> dict:
+    response = await logs.get_log_stats(
+        granularity="hour", group_by="time", action="LOGIN", username=None, since=None, until=now, limit=10
+    )
+    return {row["bucket"][:13]: row["count"] for row in json.loads(response.body)["results"] if row["count"]}
+
+async def measure(func, now: datetime, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await func(now)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+async def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [10000, 100000]
+    now = datetime.now(timezone.utc)
+    results = []
+    for size in sizes:
+        await seed(size, users=200, now=now)
+        assert dict(await before(now)) == await after(now)
+
+        repeat = 3 if size <= 10000 else 1
+        before_ms = await measure(before, now, repeat)
+        after_ms = await measure(after, now, 3)
+        # Documents each side reads; the rollup query is an index range scan on the server
+        week = {"$gte": now - timedelta(days=7), "$lt": now}
+        raw_read = await logs_collection.count_documents({"action": "LOGIN", "timestamp": week})
+        rollups_read = await log_rollups_collection.count_documents(
+            {"granularity": "hour", "action": "LOGIN", "username": None, "bucket": week}
+        )
+        results.append({
+            "raw_logs": size,
+            "rollup_documents": len(log_rollups_collection.documents),
+            "before_documents_read": raw_read,
+            "after_documents_read": rollups_read,
+            "before_ms": round(before_ms, 1),
+            "after_ms": round(after_ms, 1),
+            "speedup": round(before_ms / after_ms, 1),
+        })
+    print(json.dumps({"benchmark": "log_stats", "query": "LOGIN per hour, last 7 days", "results": results}))
+
+if __name__ == "__main__":
+    asyncio.run(main())
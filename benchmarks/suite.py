@@ -0,0 +1,357 @@
+"""
+Offline load test of the chat hot paths: WebSocket connect, group fan-out, disconnect and replay,
+/login and /api/hq/all-groups.
+
+The app runs under uvicorn on a local port, backed by the in-process MongoDB stand-in
+(benchmarks/fake_mongo.py) and the in-memory attachment storage, so nothing external is needed.
+Clients run in the same process on their own event loop.
+
+Run from the repository root:
+    python -m benchmarks.suite --clients 100 --output run.json
+    python -m benchmarks.suite --clients 100 --baseline run.json
+
+Prints one JSON document: throughput and p50/p95/p99 latencies per scenario, plus the
+ratio against a previous run when --baseline is given.
+"""
+
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import threading
+from datetime import datetime, timezone
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the chat hot paths")
+    parser.add_argument("--clients", type=int, default=100, help="simulated WebSocket clients")
+    parser.add_argument("--group-size", type=int, default=10, help="members per chat group")
+    parser.add_argument("--messages", type=int, default=20, help="live messages sent by each group's sender")
+    parser.add_argument("--backlog", type=int, default=50, help="messages replayed to each reconnecting client")
+    parser.add_argument("--logins", type=int, default=100, help="/login requests")
+    parser.add_argument("--hq-requests", type=int, default=200, help="/api/hq/all-groups requests")
+    parser.add_argument("--hq-groups", type=int, default=1000, help="extra groups listed by HQ")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent HTTP requests")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0, help="simulated database round trip (the event loop timer has about 1 ms resolution)")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12, help="bcrypt cost of the seeded passwords")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for deliveries")
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--baseline", help="results of a previous run to compare against")
+    return parser.parse_args()
+
+ARGS = parse_args() if __name__ == "__main__" else None
+
+from benchmarks import fake_mongo
+
+# Every simulated client shares one IP and bursts far above per-user limits; measure the app, not the limiter
+fake_mongo.configure_environment(
+    BCRYPT_ROUNDS=str(ARGS.bcrypt_rounds if ARGS else 12),
+    LOGIN_RATE_PER_IP="0", API_RATE_PER_USER="0", WS_MESSAGE_RATE_PER_USER="0"
+)
+fake_mongo.install((ARGS.db_latency_ms if ARGS else 0.0) / 1000)
+
+import bcrypt
+import httpx
+import uvicorn
+from bson import ObjectId
+from websockets.asyncio.client import connect
+import main
+from app.utils import create_access_token
+from database import users_collection, groups_collection
+
+PASSWORD = "benchmark-password"
+
+def percentile(samples, fraction: float) -> float:
+    """
+    Return the given percentile (0..1) of a list of samples, or 0.0 if empty
+    """
+
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(samples: list, elapsed: float, errors: int = 0) -> dict:
+    """
+    Count, throughput and latency percentiles (milliseconds) of a scenario
+    """
+
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "throughput_per_s": round(len(samples) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3) if samples else 0.0,
+    }
+
+def compare(results: dict, baseline: dict) -> dict:
+    """
+    Ratio of each latency percentile and throughput to the baseline run (below 1 is faster for latencies)
+    """
+
+    comparison = {}
+    for name, current in results.items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        comparison[name] = {
+            metric: round(current[metric] / previous[metric], 3)
+            for metric in ("throughput_per_s", "p50_ms", "p95_ms", "p99_ms")
+            if previous.get(metric)
+        }
+    return comparison
+
+class Server:
+    """
+    The app under uvicorn on a free local port, in a background thread
+    """
+
+    def __init__(self):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("Server failed to start")
+            time.sleep(0.01)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join()
+
+class Client:
+    """
+    A simulated chat client collecting the frames it receives with their arrival time
+    """
+
+    def __init__(self, user: dict, url: str):
+        self.user = user
+        self.url = url
+        self.socket = None
+        self.reader = None
+        self.frames = []
+        self.acks = []
+        self.changed = asyncio.Event()
+
+    async def connect(self):
+        self.frames, self.acks = [], []
+        self.socket = await connect(f"{self.url}?token={self.user['token']}")
+        self.reader = asyncio.create_task(self.read())
+
+    async def read(self):
+        async for raw in self.socket:
+            frame = json.loads(raw)
+            if frame.get("type") == "ping":
+                await self.socket.send('{"type": "pong"}')
+                continue
+            (self.acks if frame.get("type") == "ack" else self.frames).append((time.perf_counter(), frame))
+            self.changed.set()
+
+    async def wait_for(self, frames: int = 0, acks: int = 0):
+        while len(self.frames) < frames or len(self.acks) < acks:
+            self.changed.clear()
+            await self.changed.wait()
+
+    async def send(self, group_id: str, message: str):
+        await self.socket.send(json.dumps({"group_id": group_id, "message": message, "client_id": message}))
+
+    async def close(self):
+        await self.socket.close()
+        await self.reader
+
+async def seed(args) -> tuple:
+    """
+    Users (one bcrypt hash shared by all), chat groups of the clients, and extra groups for HQ listings
+    """
+
+    password = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds=args.bcrypt_rounds)).decode("utf-8")
+    users = []
+    for index in range(max(args.clients, 1)):
+        user = {
+            "_id": ObjectId(), "role": "user", "username": f"bench{index}", "email": f"bench{index}@example.com",
+            "password": password, "is_active": True, "is_verified": True, "created_at": datetime.now(timezone.utc)
+        }
+        await users_collection.insert_one(user)
+        user["id"] = str(user["_id"])
+        user["token"] = create_access_token(
+            {"_id": user["id"], "role": "user", "username": user["username"], "email": user["email"]}
+        )
+        users.append(user)
+
+    groups = []
+    for index in range(0, args.clients, args.group_size):
+        members = users[index:index + args.group_size]
+        group = {"name": f"chat{index}", "members": [user["id"] for user in members], "symmetric_key": "", "last_seq": 0}
+        await groups_collection.insert_one(group)
+        groups.append((str(group["_id"]), members))
+
+    for index in range(args.hq_groups):
+        members = [users[(index + offset) % len(users)]["id"] for offset in range(args.group_size)]
+        await groups_collection.insert_one({"name": f"hq{index}", "members": members, "symmetric_key": "", "last_seq": 0})
+
+    return users, groups
+
+async def websocket_scenarios(args, url: str, users: list, groups: list) -> dict:
+    """
+    Connect every client, fan out live messages, disconnect half, replay their backlog, disconnect all
+    """
+
+    results = {}
+    clients = {user["id"]: Client(user, url) for user in users}
+
+    # Connect
+    async def timed_connect(client: Client) -> float:
+        started = time.perf_counter()
+        await client.connect()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    samples = await asyncio.gather(*(timed_connect(client) for client in clients.values()))
+    results["ws_connect"] = summarize(samples, time.perf_counter() - started)
+
+    # Live fan-out: each group's first member sends, the others receive
+    sent_at = {}
+    started = time.perf_counter()
+    for index in range(args.messages):
+        for group_id, members in groups:
+            message = f"live:{group_id}:{index}"
+            sent_at[message] = time.perf_counter()
+            await clients[members[0]["id"]].send(group_id, message)
+
+    waits = []
+    for group_id, members in groups:
+        waits.append(clients[members[0]["id"]].wait_for(acks=args.messages))
+        waits += [clients[member["id"]].wait_for(frames=args.messages) for member in members[1:]]
+    await asyncio.wait_for(asyncio.gather(*waits), args.timeout)
+    elapsed = time.perf_counter() - started
+
+    deliveries = [
+        arrived - sent_at[frame["message"]]
+        for client in clients.values() for arrived, frame in client.frames if frame["message"] in sent_at
+    ]
+    acks = [
+        arrived - sent_at[ack["client_id"]]
+        for client in clients.values() for arrived, frame in client.acks for ack in frame["acks"]
+    ]
+    results["ws_fanout"] = summarize(deliveries, elapsed)
+    results["ws_ack"] = summarize(acks, elapsed)
+
+    # Half of each group's receivers go offline
+    offline = [member for _, members in groups for member in members[1::2]]
+
+    async def timed_close(client: Client) -> float:
+        started = time.perf_counter()
+        await client.close()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    samples = await asyncio.gather(*(timed_close(clients[member["id"]]) for member in offline))
+    results["ws_disconnect"] = summarize(samples, time.perf_counter() - started)
+
+    # Build their backlog, then reconnect and time until it is fully replayed
+    for group_id, members in groups:
+        sender = clients[members[0]["id"]]
+        for index in range(args.backlog):
+            await sender.send(group_id, f"backlog:{group_id}:{index}")
+    await asyncio.wait_for(asyncio.gather(*(
+        clients[members[0]["id"]].wait_for(acks=args.messages + args.backlog) for _, members in groups
+    )), args.timeout)
+
+    async def timed_replay(client: Client) -> float:
+        started = time.perf_counter()
+        await client.connect()
+        await client.wait_for(frames=args.backlog)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    samples = await asyncio.wait_for(
+        asyncio.gather(*(timed_replay(clients[member["id"]]) for member in offline)), args.timeout
+    )
+    results["ws_replay"] = summarize(samples, time.perf_counter() - started)
+
+    await asyncio.gather(*(client.close() for client in clients.values()))
+    return results
+
+async def http_scenario(requests: int, concurrency: int, call) -> dict:
+    """
+    Run call(index) requests times with bounded concurrency, timing each one
+    """
+
+    samples, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await call(index)
+            if response.status_code == 200:
+                samples.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    return summarize(samples, time.perf_counter() - started, errors)
+
+async def run(args, port: int, users: list, groups: list) -> dict:
+    results = await websocket_scenarios(args, f"ws://127.0.0.1:{port}/api/messages/ws", users, groups)
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=args.timeout) as http:
+        results["login"] = await http_scenario(args.logins, args.concurrency, lambda index: http.post(
+            "/api/users/login", json={"username": users[index % len(users)]["username"], "password": PASSWORD}
+        ))
+
+        # Walk the HQ group listing page by page
+        cursors, cursor = [None], None
+        while True:
+            page = (await http.get("/api/hq/all-groups", params={"cursor": cursor} if cursor else {})).json()
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+            cursors.append(cursor)
+
+        results["hq_all_groups"] = await http_scenario(args.hq_requests, args.concurrency, lambda index: http.get(
+            "/api/hq/all-groups", params={"cursor": cursors[index % len(cursors)]} if cursors[index % len(cursors)] else {}
+        ))
+
+    return results
+
+def main_cli(args):
+    users, groups = asyncio.run(seed(args))
+
+    server = Server()
+    server.start()
+    try:
+        scenarios = asyncio.run(run(args, server.port, users, groups))
+    finally:
+        server.stop()
+
+    report = {
+        "benchmark": "suite",
+        "python": sys.version.split()[0],
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "scenarios": scenarios,
+    }
+    if args.baseline:
+        with open(args.baseline) as file:
+            report["comparison"] = compare(scenarios, json.load(file))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+if __name__ == "__main__":
+    main_cli(ARGS)
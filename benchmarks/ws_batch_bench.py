@@ -0,0 +1,113 @@
+"""
+Throughput of ConnectionManager.send_messages for WebSocket batch sizes 1, 10 and 100.
+
+MongoDB is replaced by in-process collections that sleep for a simulated round trip on every
+call, so the numbers show what batching saves per message in database round trips.
+
+Run from the repository root:
+    python -m benchmarks.ws_batch_bench [messages] [rtt_ms]
+"""
+
+import sys
+import json
+import time
+import asyncio
+
+from benchmarks import fake_mongo
+fake_mongo.configure_environment()
+
+from bson import ObjectId
+import app.cache
+import app.messages.controller as controller
+import app.messages.watermarks as watermarks
+from app.messages.broker import InMemoryBroker
+
+GROUP_ID = ObjectId()
+MEMBERS = [str(ObjectId()) for _ in range(20)]
+
+class RoundTrip:
+    """
+    Sleeps for the simulated database round trip
+    """
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.rtt)
+
+class Groups:
+    def __init__(self, round_trip: RoundTrip):
+        self.round_trip = round_trip
+        self.last_seq = 0
+
+    async def find_one(self, query, projection=None):
+        await self.round_trip()
+        return {"_id": GROUP_ID, "name": "benchmark", "members": MEMBERS, "last_seq": self.last_seq}
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=None):
+        await self.round_trip()
+        self.last_seq += update["$inc"]["last_seq"]
+        return {"_id": GROUP_ID, "last_seq": self.last_seq}
+
+class Messages:
+    def __init__(self, round_trip: RoundTrip):
+        self.round_trip = round_trip
+        self.count = 0
+
+    async def insert_many(self, documents, ordered=True):
+        await self.round_trip()
+        self.count += len(documents)
+
+class Socket:
+    async def send_text(self, payload):
+        pass
+
+async def run(batch_size: int, messages: int, rtt: float) -> dict:
+    round_trip = RoundTrip(rtt)
+    app.cache.groups_collection = Groups(round_trip)
+    watermarks.groups_collection = app.cache.groups_collection
+    controller.messages_collection = Messages(round_trip)
+    app.cache.group_cache.clear()
+
+    manager = controller.ConnectionManager(InMemoryBroker())
+    for member_id in MEMBERS[:10]:
+        connection = controller.Connection(member_id, Socket())
+        connection.writer_task = asyncio.create_task(manager.write_loop(connection))
+        manager.active_users[member_id] = {connection}
+
+    sender = {"_id": MEMBERS[0], "username": "benchmark"}
+    items = [
+        {"group_id": str(GROUP_ID), "message": f"message {index}", "client_id": index}
+        for index in range(messages)
+    ]
+
+    started = time.perf_counter()
+    for offset in range(0, messages, batch_size):
+        await manager.send_messages(sender, items[offset:offset + batch_size])
+    elapsed = time.perf_counter() - started
+
+    for connection in manager.connections():
+        connection.writer_task.cancel()
+
+    return {
+        "batch_size": batch_size,
+        "messages": messages,
+        "messages_per_second": round(messages / elapsed, 1),
+        "db_round_trips": round_trip.calls,
+    }
+
+async def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rtt = (float(sys.argv[2]) if len(sys.argv) > 2 else 0.5) / 1000
+
+    # Keep queues from overflowing: writers drain between batches
+    controller.settings.ws_outbound_queue_size = messages
+
+    results = [await run(batch_size, messages, rtt) for batch_size in (1, 10, 100)]
+    print(json.dumps({"benchmark": "ws_batch", "rtt_ms": rtt * 1000, "results": results}))
+
+if __name__ == "__main__":
+    asyncio.run(main())
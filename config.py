@@ -1,5 +1,5 @@
 # Import necessary libraries
-from typing import List
+from typing import List, Literal, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 # Define the Settings class using Pydantic
@@ -9,10 +9,22 @@ class Settings(BaseSettings):
 
     # Database
     database_url: str
+    slow_query_ms: int = 100
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 0
+    mongo_max_idle_time_ms: Optional[int] = None
+    mongo_connect_timeout_ms: int = 5000
+    mongo_server_selection_timeout_ms: int = 10000
+    mongo_socket_timeout_ms: Optional[int] = None  # None waits indefinitely
     
     # JWT
     secret_key: str
     access_token_expire_minutes: int
+    token_cache_size: int = 100000
+
+    # Passwords
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 4
 
     # CORS
     allowed_origins: List[str]
@@ -22,6 +34,88 @@ class Settings(BaseSettings):
     aws_secret_access_key: str
     aws_region: str
     s3_bucket_name: str
+    s3_part_bytes: int = 8 * 1024 * 1024
+    s3_max_pool_connections: int = 10
+    s3_connect_timeout_seconds: float = 5
+    s3_read_timeout_seconds: float = 60
+
+    # Attachments
+    storage_backend: Literal["s3", "local", "memory"] = "s3"
+    local_storage_dir: str = "uploads"
+    local_storage_base_url: str = "/uploads"
+    local_staging_dir: str = "uploads-pending"  # direct uploads awaiting confirmation; never served
+    upload_max_bytes: int = 10 * 1024 * 1024
+    request_body_overhead_bytes: int = 64 * 1024  # multipart headers and fields allowed on top of upload_max_bytes
+    upload_chunk_bytes: int = 256 * 1024
+    upload_slot_expire_seconds: int = 900
+    direct_upload_base_url: str = "/api/messages/direct-upload"
+    upload_staging_prefix: str = "pending/"  # keep it private and expire it with an S3 lifecycle rule
+    storage_warm_on_startup: bool = False  # otherwise the S3 client is built on the first upload
+
+    # WebSocket delivery
+    ws_outbound_queue_size: int = 256
+    ws_slow_consumer_policy: Literal["drop", "disconnect", "spill"] = "spill"
+    ws_max_batch_size: int = 100
+    ws_wire_formats: List[str] = ["json", "msgpack"]
+    ws_per_message_deflate: bool = True
+    ws_heartbeat_interval_seconds: int = 20
+    ws_idle_timeout_seconds: int = 60  # 0 disables reaping
+    ws_send_timeout_seconds: float = 10
+    message_purge_interval_seconds: float = 300
+    message_purge_batch_size: int = 1000
+    replay_batch_size: int = 200
+    replay_rate_limit: float = 2000  # messages per second, 0 disables
+    watermark_flush_interval_seconds: float = 5
+
+    # Rate limits (tokens per second and bucket size; a rate of 0 disables the limiter)
+    rate_limit_max_keys: int = 100000
+    login_rate_per_ip: float = 0.5
+    login_burst_per_ip: int = 10
+    signup_rate_per_ip: float = 0.1
+    signup_burst_per_ip: int = 5
+    api_rate_per_user: float = 20
+    api_burst_per_user: int = 40
+    ws_message_rate_per_user: float = 20  # messages, a batch costs one token per item
+    ws_message_burst_per_user: int = 100
+
+    # Admission control (global caps on work in flight; 0 disables)
+    http_max_concurrency: int = 1000
+    auth_max_concurrency: int = 64
+    ws_max_connections: int = 20000
+    ws_max_concurrent_sends: int = 500
+    overload_retry_after_seconds: float = 1
+
+    # Cross-process message routing
+    broker_backend: Literal["memory", "mongo"] = "memory"
+    node_id: str = ""
+    broker_events_collection: str = "broker_events"
+    broker_events_size_bytes: int = 64 * 1024 * 1024
+    presence_ttl_seconds: int = 60
+
+    # Audit log writer
+    log_queue_size: int = 10000
+    log_batch_size: int = 500
+    log_flush_interval_seconds: float = 1
+    log_overflow_policy: Literal["drop_newest", "drop_oldest"] = "drop_oldest"
+
+    # Audit log rollups: every granularity keeps totals per action, the user ones also per username
+    log_rollup_granularities: List[Literal["minute", "hour", "day"]] = ["minute", "hour", "day"]
+    log_rollup_user_granularities: List[Literal["minute", "hour", "day"]] = ["hour", "day"]
+    log_stats_max_buckets: int = 5000
+
+    # Audit log retention (days; 0 keeps forever). Raw entries are archived before their TTL removes them.
+    log_retention_days: int = 90
+    log_archive_lead_hours: int = 24
+    log_archive_retention_days: int = 0
+    log_archive_part_size: int = 10000  # entries per archive document
+    log_compaction_interval_seconds: float = 3600
+    log_rollup_minute_retention_days: int = 14
+
+    # Caches
+    group_cache_size: int = 10000
+    group_cache_ttl_seconds: float = 60
+    user_summary_cache_size: int = 100000
+    user_summary_cache_ttl_seconds: float = 600
 
     # Import from .env file
     model_config = SettingsConfigDict(env_file=".env")
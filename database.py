@@ -1,12 +1,195 @@
-from pymongo import AsyncMongoClient
+import time
+from pymongo import AsyncMongoClient, ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
 from config import settings
+from app.metrics import MongoCommandListener
+
+def create_client() -> AsyncMongoClient:
+    """
+    Build the shared MongoDB client with the pool sizes and timeouts from settings.
+    The async client opens no connections until it is first used or connect_database runs.
+    """
+
+    return AsyncMongoClient(
+        settings.database_url,
+        maxPoolSize=settings.mongo_max_pool_size,
+        minPoolSize=settings.mongo_min_pool_size,
+        maxIdleTimeMS=settings.mongo_max_idle_time_ms,
+        connectTimeoutMS=settings.mongo_connect_timeout_ms,
+        serverSelectionTimeoutMS=settings.mongo_server_selection_timeout_ms,
+        socketTimeoutMS=settings.mongo_socket_timeout_ms,
+        # Every command is timed for /metrics
+        event_listeners=[MongoCommandListener()]
+    )
 
 # MongoDB client setup
-client = AsyncMongoClient(settings.database_url)
+client = create_client()
 db = client["chatapp"]
 
 # Collections
 users_collection = db.users
 groups_collection = db.groups
 messages_collection = db.messages
-logs_collection = db.logs
\ No newline at end of file
+logs_collection = db.logs
+log_rollups_collection = db.log_rollups
+log_archive_collection = db.log_archive
+presence_collection = db.presence
+watermarks_collection = db.delivery_watermarks
+revocations_collection = db.token_revocations
+
+# Indexes the hot queries rely on
+INDEXES = {
+    users_collection: [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("is_verified", ASCENDING)], name="is_verified"),
+    ],
+    groups_collection: [
+        IndexModel([("members", ASCENDING)], name="members"),
+    ],
+    messages_collection: [
+        IndexModel(
+            [("group_id", ASCENDING), ("seq", ASCENDING)], name="group_seq_unique", unique=True,
+            partialFilterExpression={"seq": {"$exists": True}}
+        ),
+    ],
+    watermarks_collection: [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("group_id", ASCENDING)], name="group_id"),
+    ],
+    logs_collection: [
+        IndexModel([("timestamp", DESCENDING), ("_id", DESCENDING)], name="timestamp_id"),
+        IndexModel([("username", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="username_timestamp_id"),
+        IndexModel([("action", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="action_timestamp_id"),
+        IndexModel([("target", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="target_timestamp_id"),
+    ],
+    log_rollups_collection: [
+        IndexModel(
+            [("granularity", ASCENDING), ("action", ASCENDING), ("username", ASCENDING), ("bucket", ASCENDING)],
+            name="granularity_action_username_bucket_unique", unique=True
+        ),
+    ],
+    log_archive_collection: [
+        IndexModel([("hour", ASCENDING), ("part", ASCENDING)], name="hour_part"),
+    ],
+}
+
+async def connect_database():
+    """
+    Open the client's connections and check the server answers, so the first request does not pay for it
+    """
+
+    started = time.perf_counter()
+    await client.aconnect()
+    await client.admin.command("ping")
+    print(f"MongoDB connected in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+async def close_database():
+    """
+    Close every pooled connection and stop the client's monitors
+    """
+
+    await client.close()
+
+async def ensure_indexes() -> list:
+    """
+    Create the required indexes and return the names of any that are still missing.
+    Raises RuntimeError if a unique index is missing: signup and seq assignment rely on them to reject duplicates.
+    """
+
+    missing, missing_unique = [], []
+    for collection, indexes in INDEXES.items():
+        try:
+            await collection.create_indexes(indexes)
+        except PyMongoError as e:
+            print(f"Index creation failed on {collection.name}:", e)
+
+        existing = await collection.index_information()
+        for index in indexes:
+            if index.document["name"] not in existing:
+                name = f"{collection.name}.{index.document['name']}"
+                missing.append(name)
+                if index.document.get("unique"):
+                    missing_unique.append(name)
+
+    if missing:
+        print("Missing indexes:", ", ".join(missing))
+    if missing_unique:
+        raise RuntimeError(f"Unique indexes missing, fix the duplicate documents and restart: {', '.join(missing_unique)}")
+    return missing
+
+async def ensure_ttl_index(collection, name: str, field: str, seconds: int, partial: dict = None):
+    """
+    Make a TTL index expire documents after the given seconds: create it, change its expiry in place
+    with collMod, or drop it when seconds is 0
+    """
+
+    try:
+        existing = (await collection.index_information()).get(name)
+        if not seconds:
+            if existing:
+                await collection.drop_index(name)
+        elif existing is None:
+            options = {"partialFilterExpression": partial} if partial else {}
+            await collection.create_index([(field, ASCENDING)], name=name, expireAfterSeconds=seconds, **options)
+        elif existing.get("expireAfterSeconds") != seconds:
+            await db.command("collMod", collection.name, index={"name": name, "expireAfterSeconds": seconds})
+    except PyMongoError as e:
+        print(f"TTL index setup failed on {collection.name}.{name}:", e)
+
+# Hot query shapes checked with explain in development: (collection, filter, sort)
+QUERY_SHAPES = [
+    (users_collection, {"username": ""}, None),
+    (users_collection, {"email": ""}, None),
+    (users_collection, {"is_verified": False}, None),
+    (groups_collection, {"members": ""}, None),
+    (messages_collection, {"group_id": "", "seq": {"$gt": 0}}, [("seq", ASCENDING)]),
+    (watermarks_collection, {"user_id": ""}, None),
+    (watermarks_collection, {"group_id": "", "user_id": {"$in": [""]}}, None),
+    (logs_collection, {}, [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    (logs_collection, {"username": ""}, [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    (logs_collection, {"action": ""}, [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    (logs_collection, {"target": ""}, [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    (log_rollups_collection, {"granularity": "", "action": "", "username": None, "bucket": {"$gte": 0}}, None),
+    (log_rollups_collection, {"granularity": "", "action": "", "username": {"$ne": None}, "bucket": {"$gte": 0}}, None),
+    (logs_collection, {"timestamp": {"$gte": 0, "$lt": 0}}, [("timestamp", ASCENDING), ("_id", ASCENDING)]),
+]
+
+def plan_stages(plan: dict) -> list:
+    """
+    Flatten the stage names of a query plan tree
+    """
+
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    return stages
+
+async def report_query_plans() -> list:
+    """
+    Explain each hot query shape and report the ones that scan the collection or run slowly
+    """
+
+    problems = []
+    for collection, query, sort in QUERY_SHAPES:
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+
+        try:
+            explanation = await cursor.explain()
+        except PyMongoError as e:
+            print(f"Explain failed on {collection.name}:", e)
+            continue
+
+        stages = plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+        millis = explanation.get("executionStats", {}).get("executionTimeMillis", 0)
+        if "COLLSCAN" in stages or ("SORT" in stages and sort) or millis >= settings.slow_query_ms:
+            problems.append({"collection": collection.name, "filter": query, "sort": sort, "stages": stages, "millis": millis})
+
+    for problem in problems:
+        print("Slow or unindexed query shape:", problem)
+    return problems
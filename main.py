@@ -1,12 +1,64 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
 from app.users.controller import user_router
-from app.messages.controller import message_router
+from app.messages.controller import message_router, manager, storage
+from app.messages.storage import LocalStorage
 from app.hq.routes import hq_router
-from app.logs.routes import log_router
+from app.logs.routes import log_router, log_writer
+from app.logs.retention import apply_retention, log_compactor
+from app.messages.watermarks import migrate_legacy_messages
+from app.utils import load_revocations
+from app.responses import FastJSONResponse
+from app.metrics import MetricsMiddleware, metrics_response
+from app.limits import AdmissionMiddleware, BodyLimitMiddleware
+from config import settings
+from database import connect_database, close_database, ensure_indexes, report_query_plans
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Connect the shared clients and start background jobs on startup; stop and close them on shutdown
+    """
+
+    await connect_database()
+    if settings.storage_warm_on_startup:
+        await storage.warm()
+
+    # Renumber legacy messages before any live send can take a seq from the same groups
+    await ensure_indexes()
+    await migrate_legacy_messages()
+    await apply_retention()
+    await load_revocations()
+    if settings.environment.lower() in ("dev", "development", "local"):
+        await report_query_plans()
+
+    await log_writer.start()
+    await manager.start()
+    purge_task = asyncio.create_task(manager.run_purge_loop())
+    flush_task = asyncio.create_task(manager.run_watermark_flush_loop())
+    heartbeat_task = asyncio.create_task(manager.run_heartbeat_loop())
+    compaction_task = asyncio.create_task(log_compactor.run_loop())
+    yield
+    compaction_task.cancel()
+    purge_task.cancel()
+    flush_task.cancel()
+    heartbeat_task.cancel()
+    await manager.stop()
+    await log_writer.stop()
+    await storage.close()
+    await close_database()
 
 # Initialize FastAPI app
-app = FastAPI(title="Chat App API")
+app = FastAPI(title="Chat App API", lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# Shed requests beyond http_max_concurrency before they do any work
+app.add_middleware(AdmissionMiddleware)
+
+# Refuse request bodies larger than an upload can be before they are read into memory or spooled to disk
+app.add_middleware(BodyLimitMiddleware)
 
 # Middleware for CORS
 app.add_middleware(
@@ -17,10 +69,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency histograms
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(user_router, prefix="/api/users")
 app.include_router(message_router, prefix="/api/messages")
 app.include_router(hq_router, prefix="/api/hq")
 app.include_router(log_router, prefix="/api/logs")
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Prometheus metrics: route latencies, MongoDB command timings, WebSocket delivery, uploads, rate limits,
+    admission control, caches, password hashing and the audit log writer and compactor
+    """
+
+    return metrics_response()
+
+# Serve attachments stored on local disk
+if isinstance(storage, LocalStorage):
+    app.mount(settings.local_storage_base_url, StaticFiles(directory=storage.directory), name="uploads")
 # Run command:
-# uvicorn main:app --host 0.0.0.0 --port 8000 --reload
\ No newline at end of file
+# uvicorn main:app --host 0.0.0.0 --port 8000 --reload
+# permessage-deflate on /ws is negotiated by uvicorn; disable it with --ws-per-message-deflate false
+# or run "python main.py", which applies settings.ws_per_message_deflate
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_per_message_deflate=settings.ws_per_message_deflate)
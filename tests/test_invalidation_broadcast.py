@@ -0,0 +1,60 @@
+"""
+Cache invalidations and token revocations made on one node are replayed on every other node through the broker.
+
+Run from the repository root:
+    python -m pytest -q
+"""
+
+import asyncio
+from benchmarks import fake_mongo
+
+fake_mongo.configure_environment()
+fake_mongo.install()
+
+import app.messages.controller as controller
+from app.messages.broker import InMemoryBroker
+from app.messages.controller import ConnectionManager
+
+def test_invalidations_reach_the_other_nodes(monkeypatch):
+    applied = []
+    for kind in controller.INVALIDATIONS:
+        monkeypatch.setitem(controller.INVALIDATIONS, kind, lambda key, kind=kind: applied.append(kind))
+
+    async def scenario():
+        hub = InMemoryBroker.Hub()
+        nodes = [ConnectionManager(InMemoryBroker(f"node-{index}", hub)) for index in range(3)]
+        for node in nodes:
+            await node.start()
+
+        await nodes[0].invalidate("group", "g1")
+        await nodes[0].invalidate("user_tokens", "u1")
+        await asyncio.sleep(0.01)
+
+        for node in nodes:
+            await node.stop()
+
+    asyncio.run(scenario())
+
+    # Once locally, then once on each of the two other nodes
+    assert sorted(applied) == ["group"] * 3 + ["user_tokens"] * 3
+
+def test_stored_revocations_outlive_the_broadcast(monkeypatch):
+    from app import utils
+
+    monkeypatch.setattr(utils, "revoked_users", {})
+    token = utils.create_access_token({"_id": "gone", "username": "gone"})
+
+    async def scenario():
+        # Revoked on another node: this one missed the broadcast and has not cached the token
+        await utils.store_revocation("gone")
+        rejected = await utils.authenticate_token(token) is None
+
+        # A node starting later loads it at startup
+        utils.revoked_users.clear()
+        loaded = await utils.load_revocations()
+        return rejected, loaded
+
+    rejected, loaded = asyncio.run(scenario())
+    assert rejected
+    assert loaded == 1
+    assert utils.verify_token(token) is None
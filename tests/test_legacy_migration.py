@@ -0,0 +1,53 @@
+"""
+Legacy messages (received_by/intended_for, no seq) are renumbered during startup, before the app
+takes traffic, so live sends continue the group's sequence instead of colliding with it.
+
+Run from the repository root:
+    python -m pytest -q
+"""
+
+from datetime import datetime, timezone
+from bson import ObjectId
+from benchmarks import fake_mongo
+
+fake_mongo.configure_environment()
+fake_mongo.install()
+
+from fastapi.testclient import TestClient
+import main
+from app.messages.controller import manager
+from database import groups_collection, messages_collection, watermarks_collection
+
+def test_legacy_group_is_migrated_before_live_sends():
+    group_id = ObjectId()
+    groups_collection.store({"_id": group_id, "name": "legacy", "members": ["alice", "bob"], "symmetric_key": "key"})
+    for text, received_by in (("first", ["alice", "bob"]), ("second", ["alice"]), ("third", [])):
+        messages_collection.store({
+            "group_id": str(group_id), "group_name": "legacy", "sender_id": "alice", "sender_username": "alice",
+            "message": text, "created_at": datetime.now(timezone.utc),
+            "intended_for": ["alice", "bob"], "received_by": received_by,
+        })
+
+    with TestClient(main.app) as client:
+        # Startup has already numbered the legacy messages in insertion order
+        stored = sorted(
+            (message for message in messages_collection.documents.values() if message["group_id"] == str(group_id)),
+            key=lambda message: message["_id"]
+        )
+        assert [message.get("seq") for message in stored] == [1, 2, 3]
+        assert all("received_by" not in message for message in stored)
+        assert groups_collection.documents[group_id]["last_seq"] == 3
+
+        # Each member's watermark stops before the first legacy message they had not received
+        marks = {
+            mark["user_id"]: mark["seq"] for mark in watermarks_collection.documents.values()
+            if mark["group_id"] == str(group_id)
+        }
+        assert marks == {"alice": 2, "bob": 1}
+
+        # A live send continues the sequence
+        acks = client.portal.call(
+            manager.send_messages, {"_id": "alice", "username": "alice"},
+            [{"group_id": str(group_id), "message": "live", "client_id": "c1"}]
+        )
+        assert acks == [{"client_id": "c1", "group_id": str(group_id), "seq": 4}]
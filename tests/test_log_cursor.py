@@ -0,0 +1,52 @@
+"""
+Keyset pagination of /api/logs/all-logs: following next_cursor visits every entry once, newest first,
+including entries that share a timestamp, and a malformed cursor is a 400.
+
+Run from the repository root:
+    python -m pytest -q
+"""
+
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from benchmarks import fake_mongo
+
+fake_mongo.configure_environment()
+fake_mongo.install()
+
+from app.logs.routes import get_all_logs
+from database import logs_collection
+
+def test_pages_cover_every_entry_once():
+    started = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    stored = []
+    for index in range(7):
+        # Pairs of entries share a timestamp, so the _id tie-break decides their order
+        log = {"_id": ObjectId(), "username": "paged", "action": "LOGIN", "timestamp": started + timedelta(seconds=index // 2)}
+        logs_collection.store(log)
+        stored.append(log)
+
+    async def scenario():
+        pages, cursor = [], None
+        while True:
+            response = await get_all_logs(limit=3, cursor=cursor, username="paged", action=None, target=None,
+                                          since=None, until=None, format="json")
+            page = json.loads(response.body)
+            pages.append([log["_id"] for log in page["logs"]])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return pages
+
+    pages = asyncio.run(scenario())
+    expected = [str(log["_id"]) for log in sorted(stored, key=lambda log: (log["timestamp"], log["_id"]), reverse=True)]
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [log_id for page in pages for log_id in page] == expected
+
+def test_malformed_cursor_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(get_all_logs(limit=3, cursor="not-a-cursor", username=None, action=None, target=None,
+                                 since=None, until=None, format="json"))
+    assert error.value.status_code == 400
@@ -0,0 +1,103 @@
+"""
+Back-pressure on a connection's outbound queue: producers wait for room, and closing the connection
+wakes them instead of leaving them (and the /ws endpoint behind them) waiting forever.
+
+Run from the repository root:
+    python -m pytest -q
+"""
+
+import asyncio
+import pytest
+from benchmarks import fake_mongo
+
+fake_mongo.configure_environment()
+fake_mongo.install()
+
+from app.messages.controller import OutboundQueue, QueueClosed, manager, websocket_endpoint
+from app.utils import create_access_token
+from config import settings
+
+def test_put_waits_for_room():
+    async def scenario():
+        queue = OutboundQueue(1)
+        queue.put_nowait("first")
+        waiting = asyncio.create_task(queue.put("second"))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+
+        assert await queue.get() == "first"
+        await waiting
+        assert await queue.get() == "second"
+
+    asyncio.run(scenario())
+
+def test_close_wakes_waiting_putters():
+    async def scenario():
+        queue = OutboundQueue(1)
+        queue.put_nowait("first")
+        waiting = [asyncio.create_task(queue.put(index)) for index in range(3)]
+        await asyncio.sleep(0)
+
+        queue.close()
+        results = await asyncio.gather(*waiting, return_exceptions=True)
+        assert all(isinstance(result, QueueClosed) for result in results)
+        with pytest.raises(QueueClosed):
+            await queue.put("late")
+
+    asyncio.run(scenario())
+
+class StuckSocket:
+    """
+    A client that sends frames but never reads: every send hangs
+    """
+
+    def __init__(self):
+        self.scope = {"subprotocols": []}
+        self.incoming = asyncio.Queue()
+        self.close_code = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send_text(self, payload):
+        await asyncio.Event().wait()
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+def test_endpoint_returns_when_the_client_stops_reading(monkeypatch):
+    monkeypatch.setattr(settings, "ws_outbound_queue_size", 2)
+    monkeypatch.setattr(settings, "ws_send_timeout_seconds", 0.2)
+
+    async def scenario():
+        websocket = StuckSocket()
+        for _ in range(6):
+            websocket.incoming.put_nowait({"type": "websocket.receive", "text": '{"type": "ping"}'})
+        token = create_access_token({"_id": "stuck", "username": "stuck"})
+
+        endpoint = asyncio.create_task(websocket_endpoint(websocket, token))
+        await asyncio.sleep(0.5)
+        websocket.incoming.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(endpoint, 1)
+        return websocket.close_code
+
+    assert asyncio.run(scenario()) in (1011, 1013)
+    assert manager.connection_count() == 0
+
+def test_failed_registration_leaves_nothing_behind(monkeypatch):
+    async def failing_register(user_id):
+        raise RuntimeError("broker unavailable")
+
+    monkeypatch.setattr(manager.broker, "register", failing_register)
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await manager.connect("unlucky", StuckSocket())
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert manager.connection_count() == 0
+    assert "unlucky" not in manager.active_users
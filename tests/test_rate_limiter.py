@@ -0,0 +1,75 @@
+"""
+Token buckets: a full burst is allowed, refills at the configured rate, reports how long a refused cost has to wait,
+and forgets the least recently used keys past max_keys.
+
+Run from the repository root:
+    python -m pytest -q
+"""
+
+import pytest
+from benchmarks import fake_mongo
+
+fake_mongo.configure_environment()
+
+import app.limits as limits
+from app.limits import RateLimiter
+
+class Clock:
+    """
+    A time.monotonic that only moves when told to
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(limits.time, "monotonic", clock)
+    return clock
+
+def test_burst_then_refill(clock):
+    limiter = RateLimiter("test_burst", rate=2, burst=3)
+    assert [limiter.acquire("alice") for _ in range(3)] == [0.0, 0.0, 0.0]
+
+    # Empty: one token is half a second away at two per second
+    assert limiter.acquire("alice") == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert limiter.acquire("alice") == 0.0
+
+    # Refill stops at the burst size
+    clock.now += 60
+    assert limiter.acquire("alice", cost=3) == 0.0
+    assert limiter.acquire("alice") > 0
+
+def test_keys_are_independent(clock):
+    limiter = RateLimiter("test_keys", rate=1, burst=1)
+    assert limiter.acquire("alice") == 0.0
+    assert limiter.acquire("alice") > 0
+    assert limiter.acquire("bob") == 0.0
+
+def test_least_recently_used_keys_are_forgotten(clock):
+    limiter = RateLimiter("test_lru", rate=1, burst=1, max_keys=2)
+    limiter.acquire("alice")
+    limiter.acquire("bob")
+    limiter.acquire("alice")
+    limiter.acquire("carol")
+
+    assert list(limiter.buckets) == ["alice", "carol"]
+
+    # A forgotten bucket comes back full
+    assert limiter.acquire("bob") == 0.0
+
+def test_zero_rate_disables_the_limiter(clock):
+    limiter = RateLimiter("test_disabled", rate=0, burst=1)
+    assert all(limiter.acquire("alice") == 0.0 for _ in range(10))
+
+def test_cost_above_the_burst_never_fits(clock):
+    limiter = RateLimiter("test_fits", rate=10, burst=5)
+    assert limiter.fits(5)
+    assert not limiter.fits(6)
+    assert RateLimiter("test_fits_disabled", rate=0, burst=5).fits(6)
@@ -0,0 +1,83 @@
+"""
+Replay on connect: groups already at their last seq are not scanned, a message both read from the backlog and
+fanned out live goes out once, and the watermark ends at the last message sent.
+
+Run from the repository root:
+    python -m pytest -q
+"""
+
+import asyncio
+import json
+from datetime import datetime, timezone
+from bson import ObjectId
+from benchmarks import fake_mongo
+
+fake_mongo.configure_environment()
+fake_mongo.install()
+
+from app.messages.broker import InMemoryBroker
+from app.messages.codec import Frame
+from app.messages.controller import ConnectionManager
+from app.messages.watermarks import init_member_watermarks, load_watermarks
+from database import groups_collection, messages_collection
+
+class RecordingSocket:
+    """
+    A client that reads every frame straight away
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, payload):
+        self.sent.append(json.loads(payload))
+
+    async def close(self, code=1000):
+        pass
+
+def store_message(group_id: str, seq: int) -> dict:
+    message = {
+        "_id": ObjectId(), "group_id": group_id, "seq": seq, "group_name": "g", "sender_id": "bob",
+        "sender_username": "bob", "message": f"m{seq}", "created_at": datetime.now(timezone.utc)
+    }
+    messages_collection.store(message)
+    return message
+
+def test_replay_skips_caught_up_groups_and_live_duplicates(monkeypatch):
+    caught_up, behind = ObjectId(), ObjectId()
+    groups_collection.store({"_id": caught_up, "name": "caught-up", "members": ["carol"], "last_seq": 3})
+    groups_collection.store({"_id": behind, "name": "behind", "members": ["carol"], "last_seq": 0})
+
+    scanned = []
+    find = messages_collection.find
+    monkeypatch.setattr(messages_collection, "find", lambda query, *args: scanned.append(query["group_id"]) or find(query, *args))
+
+    async def scenario():
+        # Carol joined both groups, then two messages were sent to one of them while she was away
+        await init_member_watermarks(str(caught_up), ["carol"])
+        await init_member_watermarks(str(behind), ["carol"])
+        groups_collection.documents[behind]["last_seq"] = 2
+        backlog = [store_message(str(behind), seq) for seq in (1, 2)]
+
+        manager = ConnectionManager(InMemoryBroker())
+        websocket = RecordingSocket()
+        connection = await manager.connect("carol", websocket)
+
+        # Seq 2 is fanned out live before the replay reads it from the backlog
+        live = {key: value for key, value in backlog[1].items() if key != "_id"}
+        live["created_at"] = live["created_at"].isoformat()
+        manager.enqueue(connection, Frame(live))
+
+        await manager.check_undelivered_messages(connection)
+        await manager.flush_watermarks(connection)
+        manager.disconnect(connection)
+        return websocket.sent, connection, await load_watermarks("carol")
+
+    sent, connection, stored = asyncio.run(scenario())
+    assert scanned == [str(behind)]
+    assert sorted(frame["seq"] for frame in sent) == [1, 2]
+    assert connection.replay_from == {} and connection.replay_sent == {}
+    assert stored == {str(caught_up): 3, str(behind): 2}
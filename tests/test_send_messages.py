@@ -0,0 +1,59 @@
+"""
+Groups changing under an open connection. A batch naming a group deleted after its membership was cached acks
+that group's items with group_not_found instead of failing the whole batch (and the socket it came from), and
+flushing a connection's watermarks does not bring back the watermark of a group the user was removed from.
+
+Run from the repository root:
+    python -m pytest -q
+"""
+
+import asyncio
+from bson import ObjectId
+from benchmarks import fake_mongo
+
+fake_mongo.configure_environment()
+fake_mongo.install()
+
+from app.cache import get_group_membership
+from app.messages.broker import InMemoryBroker
+from app.messages.controller import ConnectionManager
+from app.messages.watermarks import init_member_watermarks, load_watermarks, remove_watermarks, save_watermarks
+from database import groups_collection
+
+def test_deleted_group_is_acked_as_not_found():
+    live, deleted = ObjectId(), ObjectId()
+    for group_id in (live, deleted):
+        groups_collection.store({"_id": group_id, "name": str(group_id), "members": ["alice"], "last_seq": 0})
+
+    async def scenario():
+        manager = ConnectionManager(InMemoryBroker())
+
+        # Membership is cached, then the group is removed behind the cache's back
+        assert await get_group_membership(str(deleted))
+        del groups_collection.documents[deleted]
+
+        return await manager.send_messages({"_id": "alice", "username": "alice"}, [
+            {"group_id": str(deleted), "message": "lost", "client_id": "c1"},
+            {"group_id": str(live), "message": "kept", "client_id": "c2"},
+        ])
+
+    acks = asyncio.run(scenario())
+    assert acks == [
+        {"client_id": "c1", "error": "group_not_found"},
+        {"client_id": "c2", "group_id": str(live), "seq": 1},
+    ]
+
+def test_flush_does_not_recreate_a_removed_watermark():
+    group_id = ObjectId()
+    groups_collection.store({"_id": group_id, "name": "left", "members": ["bob"], "last_seq": 3})
+
+    async def scenario():
+        await init_member_watermarks(str(group_id), ["bob"])
+        await save_watermarks("bob", {str(group_id): 2})
+
+        # HQ removes bob from the group while his socket still holds a watermark for it
+        await remove_watermarks(user_id="bob", group_id=str(group_id))
+        await save_watermarks("bob", {str(group_id): 3})
+        return await load_watermarks("bob")
+
+    assert str(group_id) not in asyncio.run(scenario())